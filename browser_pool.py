@@ -0,0 +1,256 @@
+"""
+Browser Pool
+常駐的 Chromium 瀏覽器：在背景事件迴圈中只啟動一次，每次抓取開新的 context
+"""
+
+import asyncio
+import atexit
+import concurrent.futures
+import os
+import threading
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, Optional
+from playwright.async_api import async_playwright
+
+
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+VIEWPORT = {'width': 1280, 'height': 900}
+
+# Scrapes sharing the browser at the same time
+MAX_CONTEXTS = int(os.environ.get('BROWSER_MAX_CONTEXTS', '2'))
+
+# Restart the browser after this many contexts (one scrape page each)
+RECYCLE_AFTER = int(os.environ.get('BROWSER_RECYCLE_AFTER', '50'))
+
+# ... or once the Chromium processes use more than this much memory (0 = no limit)
+MEMORY_LIMIT_MB = int(os.environ.get('BROWSER_MEMORY_LIMIT_MB', '1024'))
+
+# Seconds run() waits for a scrape before giving up on it (0 = no limit)
+SCRAPE_TIMEOUT = int(os.environ.get('BROWSER_SCRAPE_TIMEOUT', '300'))
+
+
+def chromium_processes(root_pid: Optional[int] = None) -> Optional[Dict[int, int]]:
+    """
+    Resident memory (kB) of each Chromium process started by this process
+
+    Reads /proc, so it returns None on systems without it.
+    """
+    proc = Path('/proc')
+    if not proc.is_dir():
+        return None
+
+    parents, names, rss = {}, {}, {}
+    for entry in proc.iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            lines = (entry / 'status').read_text().splitlines()
+        except OSError:
+            continue
+        fields = dict(line.split(':', 1) for line in lines if ':' in line)
+        pid = int(entry.name)
+        parents[pid] = int(fields.get('PPid', '0'))
+        names[pid] = fields.get('Name', '').strip().lower()
+        rss[pid] = int(fields.get('VmRSS', '0 kB').split()[0])
+
+    # Walk down from us: python -> playwright driver -> chromium
+    root = root_pid or os.getpid()
+    descendants, todo = set(), [root]
+    while todo:
+        parent = todo.pop()
+        for pid, ppid in parents.items():
+            if ppid == parent and pid not in descendants:
+                descendants.add(pid)
+                todo.append(pid)
+
+    return {pid: rss[pid] for pid in descendants
+            if 'chrom' in names[pid] or 'headless_shell' in names[pid]}
+
+
+@asynccontextmanager
+async def browser_context(headless: bool = True, **options):
+    """
+    Launch a one-off browser and yield a context from it
+
+    For command-line scrapers that run once per process; the web app uses
+    the shared browser_pool instead.
+    """
+    async with async_playwright() as p:
+        print("正在啟動瀏覽器...")
+        browser = await p.chromium.launch(headless=headless)
+        try:
+            yield await browser.new_context(**{'viewport': VIEWPORT, 'user_agent': USER_AGENT, **options})
+        finally:
+            await browser.close()
+
+
+class BrowserPool:
+    """
+    One long-lived headless Chromium shared by all scrapes in the process
+
+    The browser lives on its own event loop in a background thread, so
+    callers on any thread can use it through run(). Each scrape gets a
+    fresh context (separate cookies and storage), at most max_contexts at
+    a time. After recycle_after contexts, or when Chromium grows past
+    memory_limit_mb, the next scrape starts a new browser and the old one
+    is closed as soon as its last context is done. Only the current
+    browser's processes count towards the memory limit.
+    """
+
+    def __init__(self, max_contexts: int = MAX_CONTEXTS, recycle_after: int = RECYCLE_AFTER,
+                 memory_limit_mb: int = MEMORY_LIMIT_MB, scrape_timeout: int = SCRAPE_TIMEOUT):
+        self.max_contexts = max(1, max_contexts)
+        self.recycle_after = recycle_after
+        self.memory_limit_mb = memory_limit_mb
+        self.scrape_timeout = scrape_timeout
+
+        self._start_lock = threading.Lock()
+        self._loop = None
+        self._semaphore = None
+        self._lock = None
+
+        self._playwright = None
+        self._browser = None
+        self._served = 0
+        self._users = {}  # browser -> open contexts
+        self._retired = {}  # replaced browser still in use -> its Chromium PIDs
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='browser-pool', daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    async def _current_processes(self) -> Dict[int, int]:
+        """Chromium processes of the current browser, leaving out replaced ones"""
+        # Scanning /proc blocks, so do it off the event loop
+        processes = await asyncio.get_running_loop().run_in_executor(None, chromium_processes)
+        retired = set().union(*self._retired.values())
+        return {pid: kb for pid, kb in (processes or {}).items() if pid not in retired}
+
+    def _needs_recycle(self, processes: Dict[int, int]) -> bool:
+        if self.recycle_after and self._served >= self.recycle_after:
+            return True
+        if self.memory_limit_mb:
+            used = sum(processes.values()) / 1024
+            if used > self.memory_limit_mb:
+                print(f"瀏覽器記憶體 {used:.0f} MB 超過上限，重新啟動")
+                return True
+        return False
+
+    async def _close_browser(self, browser):
+        self._retired.pop(browser, None)
+        try:
+            await browser.close()
+        except Exception as e:
+            print(f"關閉瀏覽器失敗: {e}")
+
+    async def _acquire(self):
+        async with self._lock:
+            browser = self._browser
+            processes = {}
+            if browser is not None and self.memory_limit_mb:
+                processes = await self._current_processes()
+            if browser is None or not browser.is_connected() or self._needs_recycle(processes):
+                if browser is not None:
+                    if self._users.get(browser):
+                        # Closed by its last user; until then its memory is not counted
+                        self._retired[browser] = set(processes)
+                    else:
+                        self._users.pop(browser, None)
+                        await self._close_browser(browser)
+                if self._playwright is None:
+                    self._playwright = await async_playwright().start()
+                print("正在啟動瀏覽器...")
+                browser = await self._playwright.chromium.launch(headless=True)
+                self._browser = browser
+                self._served = 0
+            self._served += 1
+            self._users[browser] = self._users.get(browser, 0) + 1
+            return browser
+
+    async def _release(self, browser):
+        async with self._lock:
+            self._users[browser] -= 1
+            # A browser replaced while in use is closed by its last user
+            if browser is not self._browser and not self._users[browser]:
+                del self._users[browser]
+                await self._close_browser(browser)
+
+    @asynccontextmanager
+    async def context(self, **options):
+        """Yield a fresh browser context (must run on the pool's loop)"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_contexts)
+            self._lock = asyncio.Lock()
+        async with self._semaphore:
+            browser = await self._acquire()
+            try:
+                context = await browser.new_context(
+                    **{'viewport': VIEWPORT, 'user_agent': USER_AGENT, **options})
+                try:
+                    yield context
+                finally:
+                    try:
+                        await context.close()
+                    except Exception:
+                        pass
+            finally:
+                await self._release(browser)
+
+    async def _run(self, scrape, args):
+        async with self.context() as context:
+            return await scrape(*args, context=context)
+
+    def run(self, scrape, *args):
+        """
+        Run a scraper with a pooled context and wait for its result
+
+        Args:
+            scrape: Async scraper taking a context= keyword argument,
+                e.g. scrape_playlist_to_memory
+            *args: Positional arguments for the scraper
+
+        Returns:
+            Whatever the scraper returns
+
+        Raises:
+            TimeoutError: when the scrape takes longer than scrape_timeout;
+                it is cancelled and its context closed
+        """
+        future = asyncio.run_coroutine_threadsafe(self._run(scrape, args), self._ensure_loop())
+        try:
+            return future.result(self.scrape_timeout or None)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f'抓取超過 {self.scrape_timeout} 秒，已取消')
+
+    async def _shutdown(self):
+        browsers = set(self._users)
+        if self._browser is not None:
+            browsers.add(self._browser)
+        for browser in browsers:
+            await self._close_browser(browser)
+        self._users.clear()
+        self._retired.clear()
+        self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    def close(self, timeout: float = 10):
+        """Close the browser (it is started again on the next run)"""
+        if self._loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(timeout)
+        except Exception as e:
+            print(f"關閉瀏覽器失敗: {e}")
+
+
+# Shared by the whole process
+browser_pool = BrowserPool()
+atexit.register(browser_pool.close)
@@ -4,14 +4,18 @@ Continue adding remaining songs to YouTube playlist
 繼續新增剩餘歌曲到 YouTube 歌單
 """
 
+import argparse
 import json
+from typing import Optional
 from youtube_playlist import (
     get_authenticated_service,
-    search_youtube_video,
+    match_track,
+    get_resolver,
     add_video_to_playlist,
-    SEARCH_DELAY
+    sync_playlist
 )
-import time
+from track_identity import track_key, index_by_key
+from youtube_quota import QuotaExceeded, drop_hold, hold, reserve, release, track_cost, estimate_job_cost
 
 
 def continue_adding():
@@ -27,13 +31,8 @@ def continue_adding():
     playlist_url = results['playlist_url']
     
     # Find tracks that weren't added
-    added_names = set(t['track']['name'] for t in results['added'])
-    not_found = results['not_found']
-    
-    remaining = []
-    for track in all_tracks:
-        if track['name'] not in added_names:
-            remaining.append(track)
+    added = index_by_key(results['added'], lambda entry: entry['track'])
+    remaining = [track for track in all_tracks if track_key(track) not in added]
     
     print(f"歌單: {playlist_url}")
     print(f"已新增: {len(results['added'])} 首")
@@ -43,6 +42,13 @@ def continue_adding():
         print("\n所有歌曲都已新增完成！")
         return
     
+    resolver = get_resolver()
+    estimate = estimate_job_cost(remaining, new_playlist=False, search_cost=resolver.search_cost)
+    print(f"預估配額: {estimate['units']} 單位（今日剩餘 {estimate['remaining']}）")
+    if estimate['affordable_tracks'] < len(remaining):
+        print(f"今日配額只夠處理 {estimate['affordable_tracks']} 首，"
+              f"其餘請於 {estimate['resume_at']} 之後再執行")
+    
     confirm = input(f"\n要繼續新增 {len(remaining)} 首歌曲嗎？(y/n): ").strip().lower()
     if confirm != 'y':
         print("已取消")
@@ -54,29 +60,47 @@ def continue_adding():
     
     newly_added = []
     still_not_found = []
+    deferred = []  # not searched yet because the quota ran out
     
     for i, track in enumerate(remaining):
         query = track['search_query']
-        print(f"[{i+1}/{len(remaining)}] 搜尋: {query}")
         
-        video_id = search_youtube_video(youtube, query)
+        # Stop before a track that no longer fits in today's quota
+        units = track_cost(track, resolver.search_cost)
+        try:
+            if not reserve(units):
+                raise QuotaExceeded("今日配額不足以處理下一首歌曲")
+            hold(units)
+            try:
+                print(f"[{i+1}/{len(remaining)}] 搜尋: {query}")
+                video_id, confidence = match_track(youtube, track, resolver=resolver)
+                ok = bool(video_id) and add_video_to_playlist(youtube, playlist_id, video_id)
+            finally:
+                release(drop_hold())
+        except QuotaExceeded as e:
+            print(f"\n⚠️  {e}，已停止。請於 {e.resume_at.isoformat()} 之後再執行")
+            deferred.extend(remaining[i:])
+            results['resume_at'] = e.resume_at.isoformat()
+            break
         
         if video_id:
-            if add_video_to_playlist(youtube, playlist_id, video_id):
+            if ok:
                 print(f"  ✓ 已新增: https://www.youtube.com/watch?v={video_id}")
-                newly_added.append({'track': track, 'video_id': video_id})
-                results['added'].append({'track': track, 'video_id': video_id})
+                entry = {'track': track, 'video_id': video_id, 'confidence': confidence}
+                newly_added.append(entry)
+                results['added'].append(entry)
             else:
                 print(f"  ✗ 新增失敗")
                 still_not_found.append(track)
         else:
             print(f"  ✗ 找不到影片")
             still_not_found.append(track)
-        
-        time.sleep(SEARCH_DELAY)
     
     # Update results file
     results['not_found'] = still_not_found
+    results['remaining'] = deferred
+    if not deferred:
+        results.pop('resume_at', None)
     with open('youtube_results.json', 'w', encoding='utf-8') as f:
         json.dump(results, f, ensure_ascii=False, indent=2)
     
@@ -84,8 +108,33 @@ def continue_adding():
     print(f"本次新增: {len(newly_added)} 首")
     print(f"總共新增: {len(results['added'])} 首")
     print(f"找不到: {len(still_not_found)} 首")
+    if deferred:
+        print(f"配額不足未處理: {len(deferred)} 首（{results['resume_at']} 之後可繼續）")
     print(f"\n歌單網址: {playlist_url}")
 
 
+def sync(playlist_id: Optional[str] = None, delete_extra: bool = False):
+    """Sync the YouTube playlist with spotify_tracks.json by reading its current items"""
+    with open('spotify_tracks.json', 'r', encoding='utf-8') as f:
+        all_tracks = json.load(f)['tracks']
+    
+    if not playlist_id:
+        with open('youtube_results.json', 'r', encoding='utf-8') as f:
+            playlist_id = json.load(f)['playlist_id']
+    
+    sync_playlist(all_tracks, playlist_id, delete_extra=delete_extra)
+
+
 if __name__ == '__main__':
-    continue_adding()
+    parser = argparse.ArgumentParser(description='繼續新增剩餘歌曲到 YouTube 歌單')
+    parser.add_argument('--sync', action='store_true',
+                        help='讀取 YouTube 歌單目前的內容，只新增缺少的歌曲')
+    parser.add_argument('--playlist', help='要同步的 YouTube 歌單 ID（預設讀取 youtube_results.json）')
+    parser.add_argument('--delete-extra', action='store_true',
+                        help='同步時刪除 Spotify 歌單中沒有的影片')
+    args = parser.parse_args()
+    
+    if args.sync:
+        sync(args.playlist, delete_extra=args.delete_extra)
+    else:
+        continue_adding()
@@ -5,33 +5,52 @@ SQLite Database Manager for Spotify Tracks
 
 import sqlite3
 import os
+import json
+import time
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+from track_identity import make_track_key
 
 DB_PATH = Path(__file__).parent / 'spotify_tracks.db'
 
+# Seconds a connection waits for another writer's lock before giving up;
+# download workers, resolvers and job checkpoints all write concurrently
+BUSY_TIMEOUT = 30
+
 
 def get_connection():
     """Get database connection"""
-    conn = sqlite3.connect(str(DB_PATH))
+    conn = sqlite3.connect(str(DB_PATH), timeout=BUSY_TIMEOUT)
     conn.row_factory = sqlite3.Row
     return conn
 
 
+def add_column(cursor, table: str, column: str, definition: str):
+    """Add a column to an existing table unless it is already there"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    if column not in [row['name'] for row in cursor.fetchall()]:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
 def init_db():
     """Initialize database tables"""
     conn = get_connection()
     cursor = conn.cursor()
     
+    # WAL lets readers work during a write and is kept in the database file
+    cursor.execute('PRAGMA journal_mode=WAL')
+    
     # 歌單資訊表
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS playlists (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
             url TEXT UNIQUE,
+            snapshot_id TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    add_column(cursor, 'playlists', 'snapshot_id', 'TEXT')
     
     # 歌曲資訊表
     cursor.execute('''
@@ -42,15 +61,98 @@ def init_db():
             name TEXT NOT NULL,
             artists TEXT,
             search_query TEXT,
+            track_key TEXT,
+            spotify_id TEXT,
+            duration_ms INTEGER,
             FOREIGN KEY (playlist_id) REFERENCES playlists(id) ON DELETE CASCADE
         )
     ''')
+    add_column(cursor, 'tracks', 'track_key', 'TEXT')
+    add_column(cursor, 'tracks', 'spotify_id', 'TEXT')
+    add_column(cursor, 'tracks', 'duration_ms', 'INTEGER')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tracks_track_key ON tracks(track_key)')
+    
+    # 下載索引表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS downloads (
+            track_key TEXT PRIMARY KEY,
+            video_id TEXT,
+            path TEXT NOT NULL,
+            size INTEGER,
+            mtime REAL,
+            downloaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_downloads_video_id ON downloads(video_id)')
+    
+    # 搜尋結果表：歌曲對應的 YouTube 影片 ID
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS resolved_videos (
+            track_key TEXT PRIMARY KEY,
+            video_id TEXT NOT NULL,
+            query TEXT,
+            resolved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # YouTube API 搜尋快取（video_id 為 NULL 表示找不到）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS search_cache (
+            query TEXT PRIMARY KEY,
+            video_id TEXT,
+            confidence REAL,
+            expires_at REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    add_column(cursor, 'search_cache', 'confidence', 'REAL')
+    
+    # YouTube API 配額使用紀錄（以太平洋時間的日期計算）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS quota_usage (
+            day TEXT NOT NULL,
+            method TEXT NOT NULL,
+            units INTEGER NOT NULL DEFAULT 0,
+            calls INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, method)
+        )
+    ''')
+    
+    # 背景工作表（抓取、建立歌單、下載），重啟後可續傳
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            params TEXT,
+            owner TEXT,
+            message TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # 背景工作項目表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS job_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id INTEGER NOT NULL,
+            item_index INTEGER NOT NULL,
+            payload TEXT,
+            state TEXT NOT NULL DEFAULT 'pending',
+            result TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (job_id, item_index),
+            FOREIGN KEY (job_id) REFERENCES jobs(id) ON DELETE CASCADE
+        )
+    ''')
     
     conn.commit()
     conn.close()
 
 
-def save_playlist(playlist_name: str, playlist_url: str, tracks: List[Dict]) -> int:
+def save_playlist(playlist_name: str, playlist_url: str, tracks: List[Dict],
+                  snapshot_id: Optional[str] = None) -> int:
     """
     Save playlist and tracks to database
     
@@ -58,6 +160,7 @@ def save_playlist(playlist_name: str, playlist_url: str, tracks: List[Dict]) ->
         playlist_name: Name of the playlist
         playlist_url: Spotify URL of the playlist
         tracks: List of track dictionaries
+        snapshot_id: Spotify snapshot_id of the fetched version, if known
         
     Returns:
         playlist_id: ID of the saved playlist
@@ -75,22 +178,26 @@ def save_playlist(playlist_name: str, playlist_url: str, tracks: List[Dict]) ->
         
         # 插入新歌單
         cursor.execute('''
-            INSERT INTO playlists (name, url) VALUES (?, ?)
-        ''', (playlist_name, playlist_url))
+            INSERT INTO playlists (name, url, snapshot_id) VALUES (?, ?, ?)
+        ''', (playlist_name, playlist_url, snapshot_id))
         playlist_id = cursor.lastrowid
         
         # 插入歌曲
         for i, track in enumerate(tracks):
             artists = ', '.join(track.get('artists', []))
             cursor.execute('''
-                INSERT INTO tracks (playlist_id, track_index, name, artists, search_query)
-                VALUES (?, ?, ?, ?, ?)
+                INSERT INTO tracks (playlist_id, track_index, name, artists, search_query,
+                                    track_key, spotify_id, duration_ms)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             ''', (
                 playlist_id,
                 i + 1,
                 track.get('name', ''),
                 artists,
-                track.get('search_query', f"{track.get('name', '')} {artists}")
+                track.get('search_query', f"{track.get('name', '')} {artists}"),
+                track.get('track_key') or make_track_key(track, i + 1),
+                track.get('spotify_id'),
+                track.get('duration_ms')
             ))
         
         conn.commit()
@@ -105,6 +212,22 @@ def save_playlist(playlist_name: str, playlist_url: str, tracks: List[Dict]) ->
         conn.close()
 
 
+def track_from_row(row) -> Dict:
+    """Convert a tracks table row into a track dictionary"""
+    track = {
+        'index': row['track_index'],
+        'name': row['name'],
+        'artists': [a.strip() for a in row['artists'].split(',') if a.strip()],
+        'search_query': row['search_query'],
+        'track_key': row['track_key']
+    }
+    if row['spotify_id']:
+        track['spotify_id'] = row['spotify_id']
+    if row['duration_ms']:
+        track['duration_ms'] = row['duration_ms']
+    return track
+
+
 def get_current_playlist() -> Dict:
     """
     Get the most recent playlist with tracks
@@ -118,7 +241,7 @@ def get_current_playlist() -> Dict:
     try:
         # 取得最新的歌單
         cursor.execute('''
-            SELECT id, name, url, created_at FROM playlists 
+            SELECT id, name, url, snapshot_id, created_at FROM playlists 
             ORDER BY created_at DESC LIMIT 1
         ''')
         playlist = cursor.fetchone()
@@ -133,24 +256,17 @@ def get_current_playlist() -> Dict:
         
         # 取得歌曲
         cursor.execute('''
-            SELECT track_index, name, artists, search_query 
+            SELECT track_index, name, artists, search_query, track_key, spotify_id, duration_ms
             FROM tracks WHERE playlist_id = ?
             ORDER BY track_index
         ''', (playlist['id'],))
         
-        tracks = []
-        for row in cursor.fetchall():
-            artists_list = [a.strip() for a in row['artists'].split(',') if a.strip()]
-            tracks.append({
-                'index': row['track_index'],
-                'name': row['name'],
-                'artists': artists_list,
-                'search_query': row['search_query']
-            })
+        tracks = [track_from_row(row) for row in cursor.fetchall()]
         
         return {
             'playlist_name': playlist['name'],
             'playlist_url': playlist['url'],
+            'snapshot_id': playlist['snapshot_id'],
             'total_tracks': len(tracks),
             'tracks': tracks
         }
@@ -159,6 +275,25 @@ def get_current_playlist() -> Dict:
         conn.close()
 
 
+def get_playlist_by_url(playlist_url: str) -> Optional[Dict]:
+    """
+    Get the saved copy of a playlist by its URL
+    
+    Returns:
+        Playlist dictionary with 'snapshot_id' and tracks, or None
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('SELECT id FROM playlists WHERE url = ?', (playlist_url,))
+        row = cursor.fetchone()
+    finally:
+        conn.close()
+    
+    return get_playlist_by_id(row['id']) if row else None
+
+
 def get_all_playlists() -> List[Dict]:
     """Get all saved playlists"""
     conn = get_connection()
@@ -193,24 +328,17 @@ def get_playlist_by_id(playlist_id: int) -> Optional[Dict]:
             return None
         
         cursor.execute('''
-            SELECT track_index, name, artists, search_query 
+            SELECT track_index, name, artists, search_query, track_key, spotify_id, duration_ms
             FROM tracks WHERE playlist_id = ?
             ORDER BY track_index
         ''', (playlist_id,))
         
-        tracks = []
-        for row in cursor.fetchall():
-            artists_list = [a.strip() for a in row['artists'].split(',') if a.strip()]
-            tracks.append({
-                'index': row['track_index'],
-                'name': row['name'],
-                'artists': artists_list,
-                'search_query': row['search_query']
-            })
+        tracks = [track_from_row(row) for row in cursor.fetchall()]
         
         return {
             'playlist_name': playlist['name'],
             'playlist_url': playlist['url'],
+            'snapshot_id': playlist['snapshot_id'],
             'total_tracks': len(tracks),
             'tracks': tracks
         }
@@ -219,6 +347,383 @@ def get_playlist_by_id(playlist_id: int) -> Optional[Dict]:
         conn.close()
 
 
+def get_download_index() -> Dict[str, Dict]:
+    """
+    Get all download index entries
+    
+    Returns:
+        Dictionary mapping track_key to its entry
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('SELECT track_key, video_id, path, size, mtime FROM downloads')
+        return {row['track_key']: dict(row) for row in cursor.fetchall()}
+        
+    finally:
+        conn.close()
+
+
+def save_download(track_key: str, video_id: Optional[str], path: str,
+                  size: int, mtime: float):
+    """Insert or update a download index entry"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            INSERT OR REPLACE INTO downloads (track_key, video_id, path, size, mtime)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (track_key, video_id, path, size, mtime))
+        conn.commit()
+        
+    finally:
+        conn.close()
+
+
+def delete_download(track_key: str):
+    """Remove a download index entry"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('DELETE FROM downloads WHERE track_key = ?', (track_key,))
+        conn.commit()
+        
+    finally:
+        conn.close()
+
+
+def get_resolved_videos() -> Dict[str, str]:
+    """
+    Get all resolved video IDs
+    
+    Returns:
+        Dictionary mapping track_key to video_id
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('SELECT track_key, video_id FROM resolved_videos')
+        return {row['track_key']: row['video_id'] for row in cursor.fetchall()}
+        
+    finally:
+        conn.close()
+
+
+def save_resolved_video(track_key: str, video_id: str, query: str = ''):
+    """Remember the video a track resolved to"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            INSERT OR REPLACE INTO resolved_videos (track_key, video_id, query)
+            VALUES (?, ?, ?)
+        ''', (track_key, video_id, query))
+        conn.commit()
+        
+    finally:
+        conn.close()
+
+
+def delete_resolved_video(track_key: str):
+    """Forget a resolved video, e.g. after it failed to download"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('DELETE FROM resolved_videos WHERE track_key = ?', (track_key,))
+        conn.commit()
+        
+    finally:
+        conn.close()
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a search query for use as a cache key"""
+    return ' '.join(query.lower().split())
+
+
+def get_cached_search(query: str) -> Tuple[bool, Optional[str], Optional[float]]:
+    """
+    Look up a cached search result
+    
+    Returns:
+        (hit, video_id, confidence) - video_id is None for a cached "not found"
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute(
+            'SELECT video_id, confidence FROM search_cache WHERE query = ? AND expires_at > ?',
+            (normalize_query(query), time.time())
+        )
+        row = cursor.fetchone()
+        if not row:
+            return False, None, None
+        return True, row['video_id'], row['confidence']
+        
+    finally:
+        conn.close()
+
+
+def cache_search(query: str, video_id: Optional[str], ttl: float,
+                 confidence: Optional[float] = None):
+    """
+    Cache a search result
+    
+    Args:
+        query: Search query
+        video_id: Video ID or None when nothing was found
+        ttl: Seconds until the entry expires
+        confidence: Match confidence of the video (0 to 1)
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            INSERT OR REPLACE INTO search_cache (query, video_id, confidence, expires_at)
+            VALUES (?, ?, ?, ?)
+        ''', (normalize_query(query), video_id, confidence, time.time() + ttl))
+        cursor.execute('DELETE FROM search_cache WHERE expires_at <= ?', (time.time(),))
+        conn.commit()
+        
+    finally:
+        conn.close()
+
+
+def add_quota_usage(day: str, method: str, units: int, calls: int = 1):
+    """Add quota units spent by an API method on a given day"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            INSERT INTO quota_usage (day, method, units, calls) VALUES (?, ?, ?, ?)
+            ON CONFLICT (day, method) DO UPDATE SET
+                units = units + excluded.units,
+                calls = calls + excluded.calls
+        ''', (day, method, units, calls))
+        conn.commit()
+        
+    finally:
+        conn.close()
+
+
+def get_quota_usage(day: str) -> Dict[str, int]:
+    """
+    Get quota units spent on a given day
+    
+    Returns:
+        Dictionary mapping API method to units
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('SELECT method, units FROM quota_usage WHERE day = ?', (day,))
+        return {row['method']: row['units'] for row in cursor.fetchall()}
+        
+    finally:
+        conn.close()
+
+
+# States of jobs and job items
+JOB_STATES = ('pending', 'running', 'done', 'failed')
+
+
+def _check_job_state(state: str):
+    """Raise ValueError for a state not in JOB_STATES"""
+    if state not in JOB_STATES:
+        raise ValueError(f'未知的工作狀態: {state!r}')
+
+
+def create_job(kind: str, params: Dict, items: List[Dict], owner: Optional[str] = None) -> int:
+    """
+    Create a background job with its items
+    
+    Args:
+        kind: Job type ('scrape', 'youtube_create', 'download')
+        params: JSON serializable job parameters
+        items: JSON serializable item payloads, stored in order
+        owner: Identifier of the process running the job
+        
+    Returns:
+        job_id: ID of the new job
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            INSERT INTO jobs (kind, state, params, owner) VALUES (?, 'running', ?, ?)
+        ''', (kind, json.dumps(params, ensure_ascii=False), owner))
+        job_id = cursor.lastrowid
+        
+        cursor.executemany('''
+            INSERT INTO job_items (job_id, item_index, payload) VALUES (?, ?, ?)
+        ''', [(job_id, i, json.dumps(item, ensure_ascii=False)) for i, item in enumerate(items)])
+        
+        conn.commit()
+        return job_id
+        
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def update_job(job_id: int, state: Optional[str] = None, params: Optional[Dict] = None,
+               message: Optional[str] = None):
+    """
+    Update job state, parameters or message
+    
+    Raises:
+        ValueError: if state is not one of JOB_STATES
+    """
+    if state is not None:
+        _check_job_state(state)
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        if state is not None:
+            cursor.execute('UPDATE jobs SET state = ? WHERE id = ?', (state, job_id))
+        if params is not None:
+            cursor.execute('UPDATE jobs SET params = ? WHERE id = ?',
+                           (json.dumps(params, ensure_ascii=False), job_id))
+        if message is not None:
+            cursor.execute('UPDATE jobs SET message = ? WHERE id = ?', (message, job_id))
+        cursor.execute('UPDATE jobs SET updated_at = CURRENT_TIMESTAMP WHERE id = ?', (job_id,))
+        conn.commit()
+        
+    finally:
+        conn.close()
+
+
+def update_job_item(job_id: int, item_index: int, state: str, result: Optional[Dict] = None):
+    """
+    Checkpoint the state of a single job item
+    
+    Raises:
+        ValueError: if state is not one of JOB_STATES
+    """
+    _check_job_state(state)
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            UPDATE job_items SET state = ?, result = COALESCE(?, result), updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = ? AND item_index = ?
+        ''', (
+            state,
+            json.dumps(result, ensure_ascii=False) if result is not None else None,
+            job_id,
+            item_index
+        ))
+        conn.commit()
+        
+    finally:
+        conn.close()
+
+
+def get_job_items(job_id: int, states: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Get items of a job in order
+    
+    Args:
+        job_id: Job ID
+        states: Only return items in these states
+        
+    Returns:
+        List of items with decoded 'payload' and 'result'
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        query = 'SELECT item_index, payload, state, result FROM job_items WHERE job_id = ?'
+        args = [job_id]
+        if states:
+            query += f" AND state IN ({','.join('?' * len(states))})"
+            args.extend(states)
+        cursor.execute(query + ' ORDER BY item_index', args)
+        
+        items = []
+        for row in cursor.fetchall():
+            items.append({
+                'index': row['item_index'],
+                'payload': json.loads(row['payload']) if row['payload'] else None,
+                'state': row['state'],
+                'result': json.loads(row['result']) if row['result'] else None
+            })
+        return items
+        
+    finally:
+        conn.close()
+
+
+def claim_unfinished_jobs(owner: str, is_alive) -> List[Dict]:
+    """
+    Take over jobs that were left pending or running by a dead process
+    
+    Items that were running when the process died are reset to pending.
+    
+    Args:
+        owner: Identifier of the claiming process
+        is_alive: Function called with a previous owner, returns True if that
+            process is still running the job
+        
+    Returns:
+        List of claimed jobs with decoded 'params'
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            SELECT id, kind, params, owner FROM jobs
+            WHERE state IN ('pending', 'running')
+            ORDER BY id
+        ''')
+        
+        claimed = []
+        for row in cursor.fetchall():
+            if row['owner'] == owner or (row['owner'] and is_alive(row['owner'])):
+                continue
+            
+            # Compare-and-swap so only one process takes over the job
+            cursor.execute('''
+                UPDATE jobs SET owner = ?, state = 'running', updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND owner IS ?
+            ''', (owner, row['id'], row['owner']))
+            if cursor.rowcount != 1:
+                continue
+            
+            cursor.execute('''
+                UPDATE job_items SET state = 'pending' WHERE job_id = ? AND state = 'running'
+            ''', (row['id'],))
+            conn.commit()
+            
+            claimed.append({
+                'id': row['id'],
+                'kind': row['kind'],
+                'params': json.loads(row['params']) if row['params'] else {}
+            })
+        
+        return claimed
+        
+    finally:
+        conn.close()
+
+
 def clear_all():
     """Clear all data from database"""
     conn = get_connection()
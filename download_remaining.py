@@ -7,8 +7,9 @@ Uses yt-dlp search feature (no API needed)
 
 import json
 import os
-import subprocess
 from pathlib import Path
+from downloader import download_tracks, DEFAULT_WORKERS
+from track_identity import track_key, index_by_key
 
 
 def download_remaining():
@@ -21,62 +22,33 @@ def download_remaining():
         results = json.load(f)
     
     # Find tracks that weren't added
-    added_names = set(t['track']['name'] for t in results['added'])
-    remaining = [t for t in all_tracks if t['name'] not in added_names]
+    added = index_by_key(results['added'], lambda entry: entry['track'])
+    remaining = [t for t in all_tracks if track_key(t) not in added]
     
-    print(f"準備下載剩餘 {len(remaining)} 首歌曲\n")
+    print(f"準備下載剩餘 {len(remaining)} 首歌曲（{DEFAULT_WORKERS} 個並行下載）\n")
     
     # Create download directory
     download_dir = Path('downloads')
     download_dir.mkdir(exist_ok=True)
     
-    success = 0
-    failed = []
-    
-    for i, track in enumerate(remaining):
+    def on_result(result, done, total):
+        track = result['track']
         artists = ', '.join(track['artists']) if track['artists'] else 'Unknown'
-        search_query = track['search_query']
-        
-        # Create filename
-        filename = f"{track['name']} - {artists}"
-        filename = "".join(c for c in filename if c not in r'\/:*?"<>|')
-        
-        print(f"[{i+1}/{len(remaining)}] 搜尋下載: {track['name']} - {artists}")
-        
-        try:
-            # Use yt-dlp with search
-            cmd = [
-                'yt-dlp',
-                '-x',  # Extract audio
-                '--audio-format', 'mp3',
-                '--audio-quality', '0',
-                '-o', str(download_dir / f'{filename}.%(ext)s'),
-                '--no-playlist',
-                '--quiet',
-                '--progress',
-                '--default-search', 'ytsearch',  # Use YouTube search
-                f'ytsearch:{search_query}'  # Search query
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
-            
-            if result.returncode == 0:
-                print(f"  ✓ 完成")
-                success += 1
-            else:
-                print(f"  ✗ 失敗")
-                failed.append(track['name'])
-                
-        except subprocess.TimeoutExpired:
-            print(f"  ✗ 逾時")
-            failed.append(track['name'])
-        except Exception as e:
-            print(f"  ✗ 錯誤: {e}")
-            failed.append(track['name'])
+        print(f"[{done}/{total}] 搜尋下載: {track['name']} - {artists}")
+        if result['skipped']:
+            print(f"  ✓ 已下載過，略過")
+        elif result['success']:
+            print(f"  ✓ 完成")
+        else:
+            print(f"  ✗ 失敗")
+    
+    # Use yt-dlp search for each remaining track
+    summary = download_tracks(remaining, download_dir, on_result=on_result)
+    failed = [track['name'] for track in summary['failed']]
     
     print(f"\n{'='*50}")
     print(f"下載完成！")
-    print(f"成功: {success} 首")
+    print(f"成功: {summary['success']} 首（略過已下載: {summary['skipped']} 首）")
     print(f"失敗: {len(failed)} 首")
     print(f"\n檔案位置: {download_dir.absolute()}")
     
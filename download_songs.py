@@ -4,74 +4,51 @@ Download songs from YouTube using yt-dlp
 從 YouTube 下載歌曲
 """
 
+import argparse
 import json
 import os
-import subprocess
 from pathlib import Path
+from downloader import download_tracks, download_batch, DEFAULT_WORKERS
 
 
-def download_songs():
+def download_songs(batch: bool = False):
     # Load results
     with open('youtube_results.json', 'r', encoding='utf-8') as f:
         results = json.load(f)
     
     added_tracks = results['added']
-    print(f"準備下載 {len(added_tracks)} 首歌曲\n")
+    if batch:
+        print(f"準備下載 {len(added_tracks)} 首歌曲（單一 yt-dlp 批次）\n")
+    else:
+        print(f"準備下載 {len(added_tracks)} 首歌曲（{DEFAULT_WORKERS} 個並行下載）\n")
     
     # Create download directory
     download_dir = Path('downloads')
     download_dir.mkdir(exist_ok=True)
     
-    success = 0
-    failed = []
+    # Download the already matched videos directly
+    tracks = [dict(item['track'], video_id=item['video_id']) for item in added_tracks]
     
-    for i, item in enumerate(added_tracks):
-        track = item['track']
-        video_id = item['video_id']
-        
-        # Create filename
+    def on_result(result, done, total):
+        track = result['track']
         artists = ', '.join(track['artists']) if track['artists'] else 'Unknown'
-        filename = f"{track['name']} - {artists}"
-        # Clean filename
-        filename = "".join(c for c in filename if c not in r'\/:*?"<>|')
-        
-        url = f"https://www.youtube.com/watch?v={video_id}"
-        
-        print(f"[{i+1}/{len(added_tracks)}] 下載: {track['name']} - {artists}")
-        
-        try:
-            # Use yt-dlp to download audio
-            cmd = [
-                'yt-dlp',
-                '-x',  # Extract audio
-                '--audio-format', 'mp3',
-                '--audio-quality', '0',  # Best quality
-                '-o', str(download_dir / f'{filename}.%(ext)s'),
-                '--no-playlist',
-                '--quiet',
-                '--progress',
-                url
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
-            
-            if result.returncode == 0:
-                print(f"  ✓ 完成")
-                success += 1
-            else:
-                print(f"  ✗ 失敗: {result.stderr[:100] if result.stderr else 'Unknown error'}")
-                failed.append(track['name'])
-                
-        except subprocess.TimeoutExpired:
-            print(f"  ✗ 逾時")
-            failed.append(track['name'])
-        except Exception as e:
-            print(f"  ✗ 錯誤: {e}")
-            failed.append(track['name'])
+        print(f"[{done}/{total}] 下載: {track['name']} - {artists}")
+        if result['skipped']:
+            print(f"  ✓ 已下載過，略過")
+        elif result['success']:
+            print(f"  ✓ 完成")
+        else:
+            print(f"  ✗ 失敗: {result['error'][:100]}")
+    
+    if batch:
+        summary = download_batch(tracks, download_dir, on_result=on_result)
+    else:
+        summary = download_tracks(tracks, download_dir, on_result=on_result)
+    failed = [track['name'] for track in summary['failed']]
     
     print(f"\n{'='*50}")
     print(f"下載完成！")
-    print(f"成功: {success} 首")
+    print(f"成功: {summary['success']} 首（略過已下載: {summary['skipped']} 首）")
     print(f"失敗: {len(failed)} 首")
     print(f"\n檔案位置: {download_dir.absolute()}")
     
@@ -82,4 +59,8 @@ def download_songs():
 
 
 if __name__ == '__main__':
-    download_songs()
+    parser = argparse.ArgumentParser(description='下載 youtube_results.json 中的歌曲')
+    parser.add_argument('--batch', action='store_true',
+                        help='把所有影片交給單一 yt-dlp 程序（已下載的歌曲由下載索引略過）')
+    args = parser.parse_args()
+    download_songs(batch=args.batch)
@@ -0,0 +1,1212 @@
+"""
+Concurrent Track Downloader
+並行下載引擎：多個 worker 從佇列取出歌曲並使用 yt-dlp 下載
+"""
+
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from rate_governor import governor, is_throttled_error
+from track_identity import track_key
+from database import (
+    get_download_index,
+    save_download,
+    delete_download,
+    get_resolved_videos,
+    save_resolved_video,
+    delete_resolved_video
+)
+
+
+# Number of concurrent download workers
+DEFAULT_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', '4'))
+
+# Number of concurrent search (resolve) workers
+DEFAULT_RESOLVE_WORKERS = int(os.environ.get('RESOLVE_WORKERS', '4'))
+
+# Timeout for a single track download (seconds)
+DOWNLOAD_TIMEOUT = 120
+
+# Timeout for a single search (seconds)
+RESOLVE_TIMEOUT = 30
+
+# Concurrent fragment downloads per video in batch mode
+BATCH_FRAGMENTS = int(os.environ.get('BATCH_FRAGMENTS', '4'))
+
+# Retries of a track after YouTube answered HTTP 429
+THROTTLE_RETRIES = 2
+
+# 'mp3' converts inside the download step, 'native' keeps the opus/m4a stream
+AUDIO_FORMATS = ('mp3', 'native')
+DEFAULT_AUDIO_FORMAT = os.environ.get('AUDIO_FORMAT', 'mp3')
+
+# Convert native downloads to MP3 in a separate process pool
+DEFAULT_TRANSCODE = os.environ.get('TRANSCODE', '0') == '1'
+
+# Extensions of files produced by the download modes
+AUDIO_EXTENSIONS = ('.mp3', '.m4a', '.webm', '.opus')
+
+
+def clean_filename(name: str) -> str:
+    """Remove characters that are not allowed in filenames"""
+    return "".join(c for c in name if c not in r'\/:*?"<>|')
+
+
+def track_filename(track: dict) -> str:
+    """Build the output filename (without extension) for a track"""
+    artists = ', '.join(track.get('artists') or []) or 'Unknown'
+    return clean_filename(f"{track['name']} - {artists}")
+
+
+# Progress lines printed by the yt-dlp command line, parsed back into
+# the same dictionaries the in-process progress hooks receive
+PROGRESS_PREFIX = '[progress]'
+PROGRESS_FIELDS = ('downloaded_bytes', 'total_bytes', 'total_bytes_estimate', 'speed', 'eta')
+PROGRESS_TEMPLATE = 'download:' + PROGRESS_PREFIX + ' ' + ' '.join(
+    f'%(progress.{field})s' for field in PROGRESS_FIELDS
+)
+
+
+def parse_progress_line(line: str) -> Dict:
+    """Parse a PROGRESS_TEMPLATE line into a progress hook dictionary"""
+    progress = {'status': 'downloading'}
+    values = line[len(PROGRESS_PREFIX):].split()
+    for field, value in zip(PROGRESS_FIELDS, values):
+        try:
+            progress[field] = float(value)
+        except ValueError:
+            progress[field] = None
+    return progress
+
+
+def parse_duration(value) -> Optional[float]:
+    """Parse a yt-dlp duration (seconds, possibly 'NA') into a number"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def format_bytes(size: Optional[float]) -> str:
+    """Format a byte count for display"""
+    if size is None:
+        return '--'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.1f} {unit}" if unit != 'B' else f"{int(size)} B"
+        size /= 1024
+
+
+class TransferProgress:
+    """
+    Byte-level progress of a download run
+
+    Collects yt-dlp progress hook data per track and aggregates it into
+    overall bytes, speed and ETA. snapshot() can be called from any thread.
+    """
+
+    def __init__(self, total_tracks: int = 0):
+        self.total_tracks = total_tracks
+        self.finished_tracks = 0
+        self.finished_bytes = 0
+        self.active = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def reset(self, finished_tracks: int = 0):
+        """
+        Start tracking a new run
+
+        Args:
+            finished_tracks: Tracks already finished before this run (e.g.
+                by an interrupted job), counted toward the total
+        """
+        with self._lock:
+            self.total_tracks = finished_tracks
+            self.finished_tracks = finished_tracks
+            self.finished_bytes = 0
+            self.active = {}
+            self.started = time.time()
+
+    def add_tracks(self, count: int):
+        """Add tracks to the expected total"""
+        with self._lock:
+            self.total_tracks += count
+
+    def hook(self, i: int, track: dict) -> Callable[[Dict], None]:
+        """Get a progress hook that reports into track slot i"""
+        def progress_hook(d: Dict):
+            if d.get('status') != 'downloading':
+                return
+            with self._lock:
+                self.active[i] = {
+                    'name': track.get('name', ''),
+                    'downloaded_bytes': d.get('downloaded_bytes') or 0,
+                    'total_bytes': d.get('total_bytes') or d.get('total_bytes_estimate'),
+                    'speed': d.get('speed'),
+                    'eta': d.get('eta')
+                }
+        return progress_hook
+
+    def finish(self, i: int):
+        """Mark track slot i as finished (downloaded, skipped or failed)"""
+        with self._lock:
+            entry = self.active.pop(i, None)
+            self.finished_tracks += 1
+            if entry:
+                self.finished_bytes += entry['total_bytes'] or entry['downloaded_bytes']
+
+    def snapshot(self) -> Dict:
+        """
+        Get the current aggregate progress
+
+        Returns:
+            Dictionary with 'percent', 'downloaded_bytes', 'speed', 'eta'
+            and the active 'tracks'
+        """
+        with self._lock:
+            active = [dict(entry, index=i) for i, entry in sorted(self.active.items())]
+            finished_tracks = self.finished_tracks
+            finished_bytes = self.finished_bytes
+            total_tracks = self.total_tracks
+            elapsed = time.time() - self.started
+
+        downloaded = finished_bytes + sum(t['downloaded_bytes'] for t in active)
+        speed = sum(t['speed'] or 0 for t in active) or None
+
+        # Fraction of the run, counting partial tracks
+        partial = sum(
+            t['downloaded_bytes'] / t['total_bytes']
+            for t in active if t['total_bytes']
+        )
+        percent = (finished_tracks + partial) / total_tracks * 100 if total_tracks else 0
+
+        # Estimate the bytes left from the average size of tracks seen so far
+        eta = None
+        sized = [t['total_bytes'] for t in active if t['total_bytes']]
+        if finished_bytes and finished_tracks:
+            sized.append(finished_bytes / finished_tracks)
+        if sized:
+            average = sum(sized) / len(sized)
+            remaining_tracks = total_tracks - finished_tracks - len(active)
+            remaining = max(0, remaining_tracks) * average + sum(
+                max(0, (t['total_bytes'] or average) - t['downloaded_bytes']) for t in active
+            )
+            rate = speed or (downloaded / elapsed if elapsed > 0 else None)
+            if rate:
+                eta = remaining / rate
+
+        return {
+            'percent': round(percent, 1),
+            'finished_tracks': finished_tracks,
+            'total_tracks': total_tracks,
+            'downloaded_bytes': downloaded,
+            'speed': speed,
+            'eta': eta,
+            'elapsed': elapsed,
+            'tracks': active
+        }
+
+
+def track_query(track: dict) -> str:
+    """Get the YouTube search query for a track"""
+    return track.get('search_query') or f"{track['name']} {' '.join(track.get('artists', []))}"
+
+
+def track_source(track: dict) -> str:
+    """
+    Get the yt-dlp source for a track
+
+    Tracks that already have a resolved 'video_id' are downloaded directly,
+    everything else goes through a YouTube search.
+    """
+    if track.get('video_id'):
+        return f"https://www.youtube.com/watch?v={track['video_id']}"
+    return f'ytsearch:{track_query(track)}'
+
+
+def find_track_file(download_dir: Path, track: dict) -> Optional[Path]:
+    """Find a downloaded file with the track's expected filename"""
+    stem = track_filename(track)
+    for ext in AUDIO_EXTENSIONS:
+        path = download_dir / f'{stem}{ext}'
+        if path.exists():
+            return path
+    return None
+
+
+class DownloadIndex:
+    """
+    Persistent index of finished downloads
+
+    The whole index is loaded with one query, so checking a track costs a
+    dictionary lookup plus one stat() of the recorded file. Files that were
+    renamed inside the same folder are found again by size and mtime, and
+    entries whose file was deleted are dropped so the track is downloaded
+    again.
+    """
+
+    def __init__(self, download_dir: Path):
+        self.download_dir = Path(download_dir).absolute()
+        self.entries = get_download_index()
+        self.by_video_id = {e['video_id']: e for e in self.entries.values() if e['video_id']}
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+
+    def _find_renamed(self, entry: Dict) -> Optional[Path]:
+        """Find a file with the same size and mtime as a missing entry"""
+        folder = Path(entry['path']).parent
+        if folder not in self._fingerprints:
+            fingerprints = {}
+            try:
+                with os.scandir(folder) as it:
+                    for f in it:
+                        if f.is_file():
+                            stat = f.stat()
+                            fingerprints[(stat.st_size, int(stat.st_mtime))] = Path(f.path)
+            except OSError:
+                pass
+            self._fingerprints[folder] = fingerprints
+        return self._fingerprints[folder].get((entry['size'], int(entry['mtime'] or 0)))
+
+    def _check(self, key: str, entry: Dict) -> Optional[Path]:
+        path = Path(entry['path'])
+        if path.exists():
+            return path
+
+        renamed = self._find_renamed(entry)
+        if renamed:
+            self._save(key, entry['video_id'], renamed)
+            return renamed
+
+        # File was deleted, forget it
+        delete_download(key)
+        self.entries.pop(key, None)
+        return None
+
+    def _save(self, key: str, video_id: Optional[str], path: Path):
+        stat = path.stat()
+        entry = {
+            'track_key': key,
+            'video_id': video_id,
+            'path': str(path.absolute()),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime
+        }
+        save_download(key, video_id, entry['path'], entry['size'], entry['mtime'])
+        self.entries[key] = entry
+        if video_id:
+            self.by_video_id[video_id] = entry
+
+    def lookup(self, track: dict) -> Optional[Path]:
+        """
+        Get the downloaded file of a track
+
+        Returns:
+            Path of the existing file or None if it has to be downloaded
+        """
+        key = track_key(track)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry:
+                path = self._check(key, entry)
+                if path:
+                    return path
+
+            # Same video already downloaded for another track entry
+            entry = self.by_video_id.get(track.get('video_id'))
+            if entry:
+                path = self._check(entry['track_key'], entry)
+                if path:
+                    self._save(key, entry['video_id'], path)
+                    return path
+
+            # File left by a run from before the index existed
+            expected = find_track_file(self.download_dir, track)
+            if expected:
+                self._save(key, track.get('video_id'), expected)
+                return expected
+
+        return None
+
+    def find(self, track: dict) -> Optional[Path]:
+        """
+        Get the downloaded file of a track without changing the index
+
+        Same search as lookup(), but entries of missing or renamed files are
+        left as they are, for read-only callers such as the ZIP export.
+        """
+        with self._lock:
+            for entry in (self.entries.get(track_key(track)),
+                          self.by_video_id.get(track.get('video_id'))):
+                if not entry:
+                    continue
+                path = Path(entry['path'])
+                if path.exists():
+                    return path
+                renamed = self._find_renamed(entry)
+                if renamed:
+                    return renamed
+            return find_track_file(self.download_dir, track)
+
+    def record(self, track: dict, path: str, video_id: Optional[str] = None):
+        """Add a finished download to the index"""
+        path = Path(path)
+        if not path.exists():
+            return
+        with self._lock:
+            self._save(track_key(track), video_id or track.get('video_id'), path)
+
+
+class DownloadError(Exception):
+    """Raised by a backend when a track could not be downloaded"""
+
+
+class DownloadTimeout(DownloadError):
+    """Raised from a progress hook to abort an in-process download that ran too long"""
+
+
+class SubprocessBackend:
+    """Run one yt-dlp process per track"""
+
+    name = 'subprocess'
+
+    def __init__(self, timeout: int = DOWNLOAD_TIMEOUT):
+        self.timeout = timeout
+
+    def resolve(self, query: str) -> Optional[str]:
+        """
+        Search YouTube without downloading
+
+        Returns:
+            Video ID of the first result or None if not found
+        """
+        results = self.search(query, 1)
+        return results[0]['video_id'] if results else None
+
+    def search(self, query: str, count: int = 1) -> List[Dict]:
+        """
+        Search YouTube without downloading
+
+        Returns:
+            Up to `count` results with 'video_id', 'title', 'channel' and
+            'duration' (seconds or None)
+        """
+        cmd = [
+            'yt-dlp', '--flat-playlist', '--no-warnings',
+            '--print', '%(id)s\t%(duration)s\t%(channel)s\t%(title)s',
+            f'ytsearch{count}:{query}'
+        ]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=RESOLVE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            raise DownloadError('搜尋逾時')
+        except OSError as e:
+            raise DownloadError(str(e))
+
+        if result.returncode != 0:
+            raise DownloadError(result.stderr.strip()[:200] if result.stderr else 'Unknown error')
+
+        results = []
+        for line in result.stdout.splitlines():
+            fields = line.split('\t', 3)
+            if not fields[0].strip():
+                continue
+            fields += [''] * (4 - len(fields))
+            video_id, duration, channel, title = fields
+            results.append({
+                'video_id': video_id.strip(),
+                'title': title,
+                'channel': '' if channel == 'NA' else channel,
+                'duration': parse_duration(duration)
+            })
+        return results
+
+    def download(self, source: str, output_template: str,
+                 progress_hook: Optional[Callable[[Dict], None]] = None,
+                 audio_format: str = 'mp3') -> Dict:
+        """
+        Download a source with the yt-dlp command line tool
+
+        Args:
+            source: URL or 'ytsearch:' query
+            output_template: yt-dlp output template
+            progress_hook: Called with progress dictionaries parsed from the
+                yt-dlp progress output (same keys as yt-dlp progress hooks)
+            audio_format: 'mp3' or 'native'
+
+        Returns:
+            Dictionary with download info
+        """
+        if audio_format == 'native':
+            format_args = ['-f', 'bestaudio/best']
+        else:
+            format_args = ['-x', '--audio-format', 'mp3', '--audio-quality', '0']
+
+        cmd = [
+            'yt-dlp', *format_args,
+            '-o', output_template,
+            '--no-playlist', '--quiet',
+            '--default-search', 'ytsearch',
+            '--no-simulate', '--print', 'after_move:%(id)s\t%(filepath)s',
+            '--progress', '--newline', '--progress-template', PROGRESS_TEMPLATE,
+            source
+        ]
+        if governor.bytes.rate:
+            # A subprocess cannot share the token bucket, give it its share
+            cmd[-1:-1] = ['--limit-rate', str(max(1024, int(governor.rate_share())))]
+
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    text=True, errors='replace')
+        except OSError as e:
+            raise DownloadError(str(e))
+
+        timer = threading.Timer(self.timeout, proc.kill)
+        timer.start()
+        printed = []
+        output = []
+        try:
+            for line in proc.stdout:
+                line = line.rstrip('\n')
+                if line.startswith(PROGRESS_PREFIX):
+                    if progress_hook:
+                        progress_hook(parse_progress_line(line))
+                elif '\t' in line:
+                    printed.append(line)
+                elif line.strip():
+                    output.append(line)
+            proc.wait()
+        finally:
+            timed_out = not timer.is_alive()
+            timer.cancel()
+
+        if proc.returncode != 0:
+            if timed_out:
+                raise DownloadError('逾時')
+            raise DownloadError('\n'.join(output).strip()[:200] or 'Unknown error')
+
+        if not printed:
+            return {}
+        video_id, filepath = printed[-1].split('\t', 1)
+        if progress_hook:
+            progress_hook({'status': 'finished', 'filename': filepath})
+        return {'video_id': video_id, 'filepath': filepath}
+
+
+class _YoutubeDLSession:
+    """A YoutubeDL instance plus the progress hook of the track it is serving"""
+
+    def __init__(self, options: dict, progress_hooks: List[Callable[[Dict], None]]):
+        import yt_dlp
+
+        self.progress_hooks = progress_hooks
+        self.track_hook = None
+        self.deadline = None
+        self.timed_out = False
+        self.ydl = yt_dlp.YoutubeDL(dict(options, progress_hooks=[self.dispatch]))
+
+    def dispatch(self, d: Dict):
+        # Raising from a progress hook is the only way to stop YoutubeDL
+        # mid-download; socket_timeout covers connections that stop sending
+        if self.deadline and time.monotonic() > self.deadline:
+            self.timed_out = True
+            raise DownloadTimeout('逾時')
+        hooks = list(self.progress_hooks)
+        if self.track_hook:
+            hooks.append(self.track_hook)
+        for hook in hooks:
+            try:
+                hook(d)
+            except Exception as e:
+                print(f"progress hook 錯誤: {e}")
+
+
+class YoutubeDLBackend:
+    """
+    Drive yt_dlp.YoutubeDL in-process
+
+    YoutubeDL instances are kept in an idle pool and reused across tracks
+    (and across runs), so extractor imports and the HTTP connection pool are
+    set up once per worker instead of once per track. An instance is only
+    used by one thread at a time.
+
+    Like the subprocess backend, a download is aborted after `timeout`
+    seconds; the aborted instance is dropped instead of reused.
+    """
+
+    name = 'ytdlp'
+
+    def __init__(self, progress_hooks: Optional[List[Callable[[Dict], None]]] = None,
+                 timeout: int = DOWNLOAD_TIMEOUT):
+        self.timeout = timeout
+        self.progress_hooks = list(progress_hooks or [])
+        self._idle = {audio_format: queue.LifoQueue() for audio_format in AUDIO_FORMATS}
+        self._idle_resolvers = queue.LifoQueue()
+
+    def options(self, audio_format: str = 'mp3') -> dict:
+        """YoutubeDL options equivalent to the subprocess command line"""
+        postprocessors = []
+        if audio_format == 'mp3':
+            postprocessors.append({
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'mp3',
+                'preferredquality': '0',
+            })
+        return {
+            'format': 'bestaudio/best',
+            'postprocessors': postprocessors,
+            'noplaylist': True,
+            'default_search': 'ytsearch',
+            'quiet': True,
+            'no_warnings': True,
+            'noprogress': True,
+            'socket_timeout': 30,
+        }
+
+    def _acquire(self, audio_format: str) -> _YoutubeDLSession:
+        try:
+            return self._idle[audio_format].get_nowait()
+        except queue.Empty:
+            return _YoutubeDLSession(self.options(audio_format), self.progress_hooks)
+
+    def resolve(self, query: str) -> Optional[str]:
+        """
+        Search YouTube with flat extraction (no download)
+
+        Returns:
+            Video ID of the first result or None if not found
+        """
+        results = self.search(query, 1)
+        return results[0]['video_id'] if results else None
+
+    def search(self, query: str, count: int = 1) -> List[Dict]:
+        """
+        Search YouTube with flat extraction (no download)
+
+        Returns:
+            Up to `count` results with 'video_id', 'title', 'channel' and
+            'duration' (seconds or None)
+        """
+        import yt_dlp
+        from yt_dlp.utils import DownloadError as YtDlpDownloadError
+
+        try:
+            ydl = self._idle_resolvers.get_nowait()
+        except queue.Empty:
+            ydl = yt_dlp.YoutubeDL({
+                'extract_flat': 'in_playlist',
+                'quiet': True,
+                'no_warnings': True,
+                'socket_timeout': RESOLVE_TIMEOUT,
+            })
+        try:
+            info = ydl.extract_info(f'ytsearch{count}:{query}', download=False)
+        except YtDlpDownloadError as e:
+            raise DownloadError(str(e)[:200])
+        finally:
+            self._idle_resolvers.put(ydl)
+
+        return [{
+            'video_id': entry['id'],
+            'title': entry.get('title') or '',
+            'channel': entry.get('channel') or entry.get('uploader') or '',
+            'duration': parse_duration(entry.get('duration'))
+        } for entry in (info or {}).get('entries') or [] if entry.get('id')]
+
+    def download(self, source: str, output_template: str,
+                 progress_hook: Optional[Callable[[Dict], None]] = None,
+                 audio_format: str = 'mp3') -> Dict:
+        """
+        Download a source with a pooled YoutubeDL instance
+
+        Args:
+            source: URL or 'ytsearch:' query
+            output_template: yt-dlp output template
+            progress_hook: Called with yt-dlp progress dictionaries for
+                this download only
+            audio_format: 'mp3' or 'native'
+
+        Returns:
+            Dictionary with download info
+        """
+        from yt_dlp.utils import DownloadError as YtDlpDownloadError
+
+        session = self._acquire(audio_format)
+        byte_hook = governor.byte_hook()
+
+        def track_hook(d):
+            byte_hook(d)
+            if progress_hook:
+                progress_hook(d)
+
+        session.track_hook = track_hook
+        session.deadline = time.monotonic() + self.timeout
+        session.ydl.params['outtmpl']['default'] = output_template
+        try:
+            info = session.ydl.extract_info(source, download=True)
+        except DownloadTimeout:
+            raise DownloadError('逾時')
+        except YtDlpDownloadError as e:
+            # YoutubeDL may wrap the exception raised by the hook
+            raise DownloadError('逾時' if session.timed_out else str(e)[:200])
+        finally:
+            session.track_hook = None
+            session.deadline = None
+            if not session.timed_out:
+                self._idle[audio_format].put(session)
+
+        # ytsearch: returns a playlist with a single entry
+        if info and info.get('entries'):
+            info = info['entries'][0]
+        if not info:
+            raise DownloadError('找不到影片')
+
+        downloads = info.get('requested_downloads') or [info]
+        return {'video_id': info.get('id'), 'filepath': downloads[0].get('filepath')}
+
+
+BACKENDS = {
+    SubprocessBackend.name: SubprocessBackend,
+    YoutubeDLBackend.name: YoutubeDLBackend,
+}
+
+# Default backend, override with DOWNLOAD_BACKEND=subprocess|ytdlp
+DEFAULT_BACKEND = os.environ.get('DOWNLOAD_BACKEND', YoutubeDLBackend.name)
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name: Optional[str] = None):
+    """
+    Get the shared download backend instance
+
+    Falls back to the subprocess backend when yt_dlp cannot be imported.
+    """
+    name = name or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"未知的下載後端: {name}")
+
+    with _backends_lock:
+        if name not in _backends:
+            cls = BACKENDS[name]
+            if cls is YoutubeDLBackend:
+                try:
+                    import yt_dlp  # noqa: F401
+                except ImportError:
+                    print("找不到 yt_dlp 模組，改用 subprocess 下載")
+                    cls = SubprocessBackend
+            _backends[name] = cls()
+        return _backends[name]
+
+
+def transcode_to_mp3(path: str) -> str:
+    """
+    Convert a native audio file to MP3 and remove the original
+
+    Runs in a worker process of the transcoding pool.
+
+    Returns:
+        Path of the MP3 file
+    """
+    source = Path(path)
+    if source.suffix == '.mp3':
+        return path
+
+    target = source.with_suffix('.mp3')
+    cmd = [
+        'ffmpeg', '-y', '-loglevel', 'error', '-i', str(source),
+        '-vn', '-codec:a', 'libmp3lame', '-q:a', '0',
+        str(target)
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        target.unlink(missing_ok=True)
+        raise RuntimeError(f"ffmpeg error: {result.stderr[:200]}")
+
+    source.unlink()
+    return str(target)
+
+
+_transcode_pool = None
+_transcode_pool_lock = threading.Lock()
+
+
+def get_transcode_pool() -> ProcessPoolExecutor:
+    """Get the shared transcoding process pool, sized to the core count"""
+    global _transcode_pool
+    with _transcode_pool_lock:
+        if _transcode_pool is None:
+            _transcode_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+        return _transcode_pool
+
+
+def resolve_query(backend, query: str) -> Optional[str]:
+    """Resolve a search query through the governor, retrying after HTTP 429"""
+    results = search_query(backend, query, 1)
+    return results[0]['video_id'] if results else None
+
+
+def search_query(backend, query: str, count: int) -> List[Dict]:
+    """Get up to `count` search results through the governor, retrying after HTTP 429"""
+    for attempt in range(THROTTLE_RETRIES + 1):
+        governor.acquire_request()
+        try:
+            results = backend.search(query, count)
+            governor.report_success()
+            return results
+        except DownloadError as e:
+            if not is_throttled_error(str(e)) or attempt == THROTTLE_RETRIES:
+                raise
+            governor.report_throttled()
+
+
+def download_track(track: dict, download_dir: Path, backend=None,
+                   progress_hook: Optional[Callable[[Dict], None]] = None,
+                   index: Optional[DownloadIndex] = None,
+                   audio_format: str = 'mp3') -> Dict:
+    """
+    Download a single track as MP3 or in its native audio format
+
+    Args:
+        track: Track dictionary with 'name', 'artists' and optional
+            'search_query' / 'video_id'
+        download_dir: Target directory
+        backend: Download backend (defaults to get_backend())
+        progress_hook: Optional yt-dlp progress hook for this track
+        index: Download index used to skip finished tracks
+        audio_format: 'mp3' or 'native'
+
+    Returns:
+        Dictionary with 'track', 'success', 'skipped', 'error', 'video_id',
+        'filepath' and 'elapsed'
+    """
+    start = time.time()
+    result = {
+        'track': track,
+        'success': False,
+        'skipped': False,
+        'error': None,
+        'video_id': track.get('video_id'),
+        'filepath': None
+    }
+
+    existing = index.lookup(track) if index else None
+    if existing:
+        result.update(success=True, skipped=True, filepath=str(existing))
+        result['elapsed'] = time.time() - start
+        return result
+
+    backend = backend or get_backend()
+    output_template = str(download_dir / f'{track_filename(track)}.%(ext)s')
+    for attempt in range(THROTTLE_RETRIES + 1):
+        governor.acquire_request()
+        governor.download_started()
+        try:
+            info = backend.download(track_source(track), output_template, progress_hook, audio_format)
+            governor.report_success()
+            result.update(success=True, error=None, **info)
+            if not result['filepath']:
+                expected = find_track_file(download_dir, track)
+                result['filepath'] = str(expected) if expected else None
+            if index and result['filepath']:
+                index.record(track, result['filepath'], result['video_id'])
+            break
+        except Exception as e:
+            result['error'] = str(e)
+            if not is_throttled_error(result['error']):
+                break
+            governor.report_throttled()
+        finally:
+            governor.download_finished()
+
+    result['elapsed'] = time.time() - start
+    return result
+
+
+def download_tracks(tracks: List[dict], download_dir: Path,
+                    workers: int = DEFAULT_WORKERS,
+                    backend=None,
+                    skip_existing: bool = True,
+                    resolve_workers: int = DEFAULT_RESOLVE_WORKERS,
+                    audio_format: str = DEFAULT_AUDIO_FORMAT,
+                    transcode: bool = DEFAULT_TRANSCODE,
+                    progress: Optional[TransferProgress] = None,
+                    on_start: Optional[Callable[[int, dict], None]] = None,
+                    on_result: Optional[Callable[[Dict, int, int], None]] = None) -> Dict:
+    """
+    Download tracks with a two-stage resolve/download pipeline
+
+    Resolver workers run ahead turning search queries into video IDs (reusing
+    IDs saved by earlier runs) and hand them to the download workers through
+    a bounded queue, so search latency overlaps with transfers.
+
+    With audio_format='native' the download step only fetches the audio
+    stream. If transcode is set, the MP3 conversion is queued on a process
+    pool and the download worker moves on to the next track right away.
+
+    Args:
+        tracks: List of track dictionaries
+        download_dir: Target directory
+        workers: Number of concurrent download workers
+        backend: Download backend or backend name (defaults to get_backend())
+        skip_existing: Skip tracks already recorded in the download index
+        resolve_workers: Number of concurrent resolver workers
+        audio_format: 'mp3' (convert while downloading) or 'native'
+        transcode: Convert native downloads to MP3 in the transcoding pool
+        progress: Byte-level progress tracker fed by yt-dlp progress hooks
+        on_start: Called as on_start(index, track) when a worker starts
+            downloading a track
+        on_result: Called as on_result(result, done, total) after each track
+            finishes; calls are serialized so it may update shared state
+
+    Returns:
+        Dictionary with 'total', 'success', 'skipped', 'failed' (list of
+        tracks) and 'results' (per-track results in the original order)
+    """
+    download_dir = Path(download_dir)
+    download_dir.mkdir(exist_ok=True)
+    if backend is None or isinstance(backend, str):
+        backend = get_backend(backend)
+    index = DownloadIndex(download_dir) if skip_existing else None
+    known_ids = get_resolved_videos()
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(f"未知的音訊格式: {audio_format}")
+    transcode = transcode and audio_format == 'native'
+    if progress:
+        progress.add_tracks(len(tracks))
+    transcoding = threading.Condition()
+    active_transcodes = 0
+
+    total = len(tracks)
+    results = [None] * total
+    pending = queue.Queue()
+    for i, track in enumerate(tracks):
+        pending.put((i, track))
+
+    workers = max(1, min(workers, total))
+    resolve_workers = max(1, min(resolve_workers, total))
+    resolved = queue.Queue(maxsize=workers * 2)
+
+    lock = threading.Lock()
+    done = 0
+
+    def finish(i, result):
+        nonlocal done
+        result['index'] = i
+        if progress:
+            progress.finish(i)
+        with lock:
+            results[i] = result
+            done += 1
+            if on_result:
+                try:
+                    on_result(result, done, total)
+                except Exception as e:
+                    print(f"on_result 錯誤: {e}")
+
+    def fail(i, track, error, video_id=None, start=None):
+        # Only if the track has not been finished before the error
+        if results[i] is None:
+            finish(i, {
+                'track': track, 'success': False, 'skipped': False, 'error': error,
+                'video_id': video_id, 'filepath': None,
+                'elapsed': time.time() - start if start else 0
+            })
+
+    def resolve(i, track):
+        """Get the video ID of a track, or finish it (skipped or failed) and return None"""
+        existing = index.lookup(track) if index else None
+        if existing:
+            finish(i, {
+                'track': track, 'success': True, 'skipped': True, 'error': None,
+                'video_id': track.get('video_id') or known_ids.get(track_key(track)),
+                'filepath': str(existing), 'elapsed': 0
+            })
+            return None
+
+        cached = False
+        video_id = track.get('video_id')
+        if not video_id:
+            key = track_key(track)
+            video_id = known_ids.get(key)
+            cached = video_id is not None
+            if not video_id:
+                start = time.time()
+                try:
+                    video_id = resolve_query(backend, track_query(track))
+                except Exception as e:
+                    fail(i, track, str(e), start=start)
+                    return None
+                if not video_id:
+                    fail(i, track, '找不到影片', start=start)
+                    return None
+                save_resolved_video(key, video_id, track_query(track))
+
+        return i, track, video_id, cached
+
+    def resolver():
+        while True:
+            try:
+                i, track = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                item = resolve(i, track)
+            except Exception as e:
+                # e.g. a database error while saving the video ID
+                fail(i, track, str(e))
+                continue
+            if item:
+                resolved.put(item)
+
+    def downloader():
+        while True:
+            item = resolved.get()
+            if item is None:
+                return
+            i, track, video_id, cached = item
+            try:
+                download(i, track, video_id, cached)
+            except Exception as e:
+                fail(i, track, str(e), video_id)
+
+    def download(i, track, video_id, cached):
+        nonlocal active_transcodes
+        if on_start:
+            try:
+                on_start(i, track)
+            except Exception as e:
+                print(f"on_start 錯誤: {e}")
+
+        result = download_track(dict(track, video_id=video_id), download_dir, backend,
+                                progress_hook=progress.hook(i, track) if progress else None,
+                                index=index, audio_format=audio_format)
+        result['track'] = track
+        if not result['success'] and cached:
+            # The saved video may be gone, search again next time
+            delete_resolved_video(track_key(track))
+
+        if transcode and result['success'] and result['filepath']:
+            with transcoding:
+                active_transcodes += 1
+            try:
+                future = get_transcode_pool().submit(transcode_to_mp3, result['filepath'])
+            except Exception as e:
+                # e.g. BrokenProcessPool after a worker crashed
+                with transcoding:
+                    active_transcodes -= 1
+                    transcoding.notify_all()
+                finish(i, dict(result, success=False, error=f'轉檔失敗: {e}'))
+                return
+            future.add_done_callback(lambda f, i=i, result=result: transcoded(i, result, f))
+        else:
+            finish(i, result)
+
+    def transcoded(i, result, future):
+        nonlocal active_transcodes
+        try:
+            result['filepath'] = future.result()
+            if index:
+                index.record(result['track'], result['filepath'], result['video_id'])
+        except Exception as e:
+            # Keep the native file, it is still playable
+            result['transcode_error'] = str(e)
+        finish(i, result)
+        with transcoding:
+            active_transcodes -= 1
+            transcoding.notify_all()
+
+    resolvers = [threading.Thread(target=resolver, daemon=True) for _ in range(resolve_workers)]
+    downloaders = [threading.Thread(target=downloader, daemon=True) for _ in range(workers)]
+    for t in resolvers + downloaders:
+        t.start()
+    for t in resolvers:
+        t.join()
+    for _ in downloaders:
+        resolved.put(None)
+    for t in downloaders:
+        t.join()
+    with transcoding:
+        transcoding.wait_for(lambda: active_transcodes == 0)
+
+    return {
+        'total': total,
+        'success': sum(1 for r in results if r and r['success']),
+        'skipped': sum(1 for r in results if r and r['skipped']),
+        'failed': [r['track'] for r in results if r and not r['success']],
+        'results': results
+    }
+
+
+def download_batch(tracks: List[dict], download_dir: Path,
+                   audio_format: str = DEFAULT_AUDIO_FORMAT,
+                   on_result: Optional[Callable[[Dict, int, int], None]] = None) -> Dict:
+    """
+    Download tracks with known video IDs in a single yt-dlp session
+
+    Tracks already in the download index are skipped; the remaining IDs are
+    written to a batch file and handed to one yt-dlp process, so process
+    startup and connection setup happen once per playlist and fragments are
+    fetched concurrently. The process gets DOWNLOAD_TIMEOUT seconds per
+    video in total and its share of the governor's bandwidth.
+
+    Args:
+        tracks: Track dictionaries, each with a 'video_id'
+        download_dir: Target directory
+        audio_format: 'mp3' or 'native'
+        on_result: Called as on_result(result, done, total) for each track
+
+    Returns:
+        Same summary dictionary as download_tracks()
+    """
+    download_dir = Path(download_dir)
+    download_dir.mkdir(exist_ok=True)
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(f"未知的音訊格式: {audio_format}")
+    index = DownloadIndex(download_dir)
+
+    total = len(tracks)
+    results = [None] * total
+    done = 0
+
+    def finish(i, result):
+        nonlocal done
+        result['index'] = i
+        results[i] = result
+        done += 1
+        if on_result:
+            try:
+                on_result(result, done, total)
+            except Exception as e:
+                print(f"on_result 錯誤: {e}")
+
+    # Skip finished tracks, group the rest by video ID
+    waiting = {}
+    for i, track in enumerate(tracks):
+        existing = index.lookup(track)
+        if existing:
+            finish(i, {
+                'track': track, 'success': True, 'skipped': True, 'error': None,
+                'video_id': track['video_id'], 'filepath': str(existing), 'elapsed': 0
+            })
+        else:
+            waiting.setdefault(track['video_id'], []).append(i)
+
+    if waiting:
+        if audio_format == 'native':
+            format_args = ['-f', 'bestaudio/best']
+        else:
+            format_args = ['-x', '--audio-format', 'mp3', '--audio-quality', '0']
+
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8') as batch:
+            for video_id in waiting:
+                batch.write(f"https://www.youtube.com/watch?v={video_id}\n")
+
+        cmd = [
+            'yt-dlp', *format_args,
+            '-a', batch.name,
+            '-o', str(download_dir / '%(id)s.%(ext)s'),
+            '-N', str(BATCH_FRAGMENTS),
+            '--no-playlist', '--quiet', '--ignore-errors',
+            '--no-simulate', '--print', 'after_move:%(id)s\t%(filepath)s'
+        ]
+        if governor.requests.rate:
+            cmd += ['--sleep-requests', f"{1 / governor.requests.rate:.2f}"]
+
+        # The batch counts as one download towards the shared bandwidth
+        governor.download_started()
+        if governor.bytes.rate:
+            cmd += ['--limit-rate', str(max(1024, int(governor.rate_share())))]
+
+        start = time.time()
+        errors = []
+        timer = None
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    text=True, errors='replace')
+            timer = threading.Timer(DOWNLOAD_TIMEOUT * len(waiting), proc.kill)
+            timer.start()
+            for line in proc.stdout:
+                line = line.rstrip('\n')
+                if '\t' not in line:
+                    if line.startswith('ERROR'):
+                        errors.append(line)
+                    continue
+
+                video_id, filepath = line.split('\t', 1)
+                first = None
+                for i in waiting.pop(video_id, []):
+                    track = tracks[i]
+                    # Rename from the video ID to the usual track filename,
+                    # tracks sharing the same video get a copy
+                    target = download_dir / f'{track_filename(track)}{Path(filepath).suffix}'
+                    try:
+                        if first is None:
+                            os.replace(filepath, target)
+                            first = target
+                        elif target != first:
+                            shutil.copyfile(first, target)
+                        index.record(track, str(target), video_id)
+                        result = {'success': True, 'error': None, 'filepath': str(target)}
+                    except OSError as e:
+                        result = {'success': False, 'error': str(e), 'filepath': None}
+                    finish(i, dict(result, track=track, skipped=False, video_id=video_id,
+                                   elapsed=time.time() - start))
+            proc.wait()
+            if not timer.is_alive():
+                errors.append('逾時')
+        except OSError as e:
+            errors.append(str(e))
+        finally:
+            if timer:
+                timer.cancel()
+            governor.download_finished()
+            os.unlink(batch.name)
+
+        # Anything not printed by yt-dlp failed
+        for video_id, indices in waiting.items():
+            message = next((e for e in errors if video_id in e), None) or (errors[-1] if errors else '下載失敗')
+            for i in indices:
+                finish(i, {
+                    'track': tracks[i], 'success': False, 'skipped': False, 'error': message[:200],
+                    'video_id': video_id, 'filepath': None, 'elapsed': time.time() - start
+                })
+
+    return {
+        'total': total,
+        'success': sum(1 for r in results if r and r['success']),
+        'skipped': sum(1 for r in results if r and r['skipped']),
+        'failed': [r['track'] for r in results if r and not r['success']],
+        'results': results
+    }
+
+
+if __name__ == '__main__':
+    # Benchmark: python downloader.py --backend subprocess "query 1" "query 2"
+    import argparse
+
+    parser = argparse.ArgumentParser(description='下載歌曲並計時')
+    parser.add_argument('queries', nargs='+', help='搜尋字串')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default=DEFAULT_BACKEND)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--output', default='downloads')
+    args = parser.parse_args()
+
+    tracks = [{'name': q, 'artists': [], 'search_query': q} for q in args.queries]
+    start = time.time()
+    summary = download_tracks(
+        tracks, Path(args.output), workers=args.workers, backend=args.backend,
+        on_result=lambda r, done, total: print(
+            f"[{done}/{total}] {'✓' if r['success'] else '✗'} {r['track']['name']} ({r['elapsed']:.1f}s)"
+        )
+    )
+    print(f"\n後端: {args.backend}  成功: {summary['success']}/{summary['total']}  總耗時: {time.time() - start:.1f}s")
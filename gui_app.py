@@ -11,6 +11,7 @@ import os
 import subprocess
 from pathlib import Path
 from database import get_current_playlist
+from downloader import download_tracks, format_bytes, TransferProgress
 
 
 class SpotifyYouTubeGUI:
@@ -27,6 +28,7 @@ class SpotifyYouTubeGUI:
         
         self.create_widgets()
         self.tracks = []
+        self.transfer = None
         
         # Setup clipboard bindings after widgets are created
         self.setup_clipboard_bindings()
@@ -349,35 +351,16 @@ class SpotifyYouTubeGUI:
             download_dir.mkdir(exist_ok=True)
             
             total = len(self.tracks)
-            success = 0
             
-            for i, track in enumerate(self.tracks):
-                artists = ', '.join(track.get('artists', []))
-                search_query = track.get('search_query', f"{track['name']} {artists}")
-                
-                filename = f"{track['name']} - {artists}"
-                filename = "".join(c for c in filename if c not in r'\/:*?"<>|')
-                
-                self.root.after(0, lambda t=track, idx=i: self.log(f"[{idx+1}/{total}] {t['name']}"))
-                self.root.after(0, lambda p=(i+1)/total*100: self.progress_var.set(p))
-                
-                try:
-                    cmd = [
-                        'yt-dlp', '-x', '--audio-format', 'mp3',
-                        '--audio-quality', '0',
-                        '-o', str(download_dir / f'{filename}.%(ext)s'),
-                        '--no-playlist', '--quiet',
-                        '--default-search', 'ytsearch',
-                        f'ytsearch:{search_query}'
-                    ]
-                    
-                    result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
-                    
-                    if result.returncode == 0:
-                        success += 1
-                        
-                except Exception as e:
-                    pass
+            def on_result(result, done, total):
+                track = result['track']
+                mark = '✓' if result['success'] else '✗'
+                self.root.after(0, lambda t=track, d=done, m=mark: self.log(f"[{d}/{total}] {m} {t['name']}"))
+            
+            self.transfer = TransferProgress()
+            self.root.after(0, self.update_transfer_progress)
+            summary = download_tracks(self.tracks, download_dir, progress=self.transfer, on_result=on_result)
+            success = summary['success']
             
             self.root.after(0, lambda: self.log(f"\n下載完成！成功: {success}/{total}"))
             self.root.after(0, lambda: self.progress_var.set(100))
@@ -387,9 +370,26 @@ class SpotifyYouTubeGUI:
             self.root.after(0, lambda: self.log(f"錯誤: {e}"))
             self.root.after(0, lambda: messagebox.showerror("錯誤", str(e)))
         finally:
+            # Stops update_transfer_progress, also when the download failed
+            self.transfer = None
             self.root.after(0, lambda: self.download_btn.configure(state=tk.NORMAL))
             self.root.after(0, lambda: self.status_var.set("就緒"))
             
+    def update_transfer_progress(self):
+        """Refresh the progress bar with byte-level progress while downloading"""
+        if not self.transfer:
+            return
+        
+        snapshot = self.transfer.snapshot()
+        self.progress_var.set(snapshot['percent'])
+        eta = f"{int(snapshot['eta']) // 60}:{int(snapshot['eta']) % 60:02d}" if snapshot['eta'] is not None else '--'
+        self.status_var.set(
+            f"下載中 {snapshot['finished_tracks']}/{snapshot['total_tracks']} ｜ "
+            f"{format_bytes(snapshot['downloaded_bytes'])}，"
+            f"{format_bytes(snapshot['speed'])}/s，剩餘 {eta}"
+        )
+        self.root.after(500, self.update_transfer_progress)
+            
     def open_download_folder(self):
         base_dir = os.path.dirname(os.path.abspath(__file__))
         download_dir = Path(os.path.join(base_dir, 'downloads'))
@@ -0,0 +1,10 @@
+"""
+Gunicorn Configuration
+gunicorn 啟動時自動載入：worker 就緒後繼續執行中斷的背景工作
+"""
+
+
+def post_worker_init(worker):
+    """Resume interrupted jobs once the worker has loaded the app"""
+    from web_app import resume_jobs
+    resume_jobs()
@@ -6,6 +6,7 @@ Opens browser and waits for user to scroll, then collects all tracks
 import asyncio
 import json
 from playwright.async_api import async_playwright
+from track_identity import spotify_id_from_url, assign_track_keys
 
 
 async def interactive_scrape(playlist_url: str) -> dict:
@@ -76,6 +77,8 @@ async def interactive_scrape(playlist_url: str) -> dict:
                         continue
                     
                     track_name = track_name.strip()
+                    link = await row.query_selector('a[data-testid="internal-track-link"]')
+                    spotify_id = spotify_id_from_url(await link.get_attribute('href')) if link else None
                     
                     # Get artists
                     artist_elems = await row.query_selector_all('a[href^="/artist/"]')
@@ -85,7 +88,7 @@ async def interactive_scrape(playlist_url: str) -> dict:
                         if name and name.strip() and name.strip() not in artists:
                             artists.append(name.strip())
                     
-                    key = f"{track_name}|{'|'.join(artists)}"
+                    key = spotify_id or f"{track_name}|{'|'.join(artists)}"
                     
                     if key not in seen:
                         seen.add(key)
@@ -93,7 +96,8 @@ async def interactive_scrape(playlist_url: str) -> dict:
                             'index': len(tracks) + 1,
                             'name': track_name,
                             'artists': artists,
-                            'search_query': f"{track_name} {' '.join(artists)}"
+                            'search_query': f"{track_name} {' '.join(artists)}",
+                            'spotify_id': spotify_id
                         })
                         print(f"  [{len(tracks)}] {track_name} - {', '.join(artists)}")
                 except:
@@ -111,6 +115,7 @@ async def interactive_scrape(playlist_url: str) -> dict:
         
         await browser.close()
     
+    assign_track_keys(tracks)
     result = {
         'playlist_name': playlist_name,
         'playlist_url': playlist_url,
@@ -0,0 +1,180 @@
+"""
+Download Rate Governor
+下載速率控制：所有下載 worker 共用的頻寬與請求速率上限
+"""
+
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+
+# Total download bandwidth cap, e.g. '2M' (bytes/sec, 0 = unlimited)
+DEFAULT_BYTES_PER_SEC = os.environ.get('DOWNLOAD_RATE_LIMIT', '0')
+
+# Requests (searches and downloads) per second across all workers (0 = unlimited)
+DEFAULT_REQUESTS_PER_SEC = os.environ.get('DOWNLOAD_REQUEST_RATE', '0')
+
+# Backoff after YouTube answers HTTP 429
+BACKOFF_BASE = 5  # seconds
+BACKOFF_MAX = 300  # seconds
+
+
+def parse_rate(value) -> float:
+    """Parse a rate like '500K', '2M' or '1.5' into a number"""
+    if value is None or value == '':
+        return 0
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMG]?)i?B?\s*', str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"無效的速率: {value}")
+    number, unit = match.groups()
+    return float(number) * {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}[unit.upper()]
+
+
+def is_throttled_error(error: Optional[str]) -> bool:
+    """Check whether a yt-dlp error message means YouTube is throttling us"""
+    return bool(error) and ('HTTP Error 429' in error or 'Too Many Requests' in error)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket
+
+    Callers reserve tokens up front and sleep off any debt, so concurrent
+    callers are served in order at the configured rate. A rate of 0 means
+    unlimited.
+    """
+
+    def __init__(self, rate: float = 0, burst: float = 1.0):
+        self.burst = burst
+        self._lock = threading.Lock()
+        self.set_rate(rate)
+
+    def set_rate(self, rate: float):
+        """Change the rate, keeping at most `burst` seconds of tokens"""
+        with self._lock:
+            self.rate = max(0.0, float(rate))
+            self.capacity = self.rate * self.burst
+            self.tokens = self.capacity
+            self.updated = time.monotonic()
+
+    def acquire(self, amount: float = 1):
+        """Take tokens, blocking until the rate allows it"""
+        with self._lock:
+            if not self.rate:
+                return
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class DownloadGovernor:
+    """
+    Shared bandwidth and request-rate limits for all download workers
+
+    - bytes/sec is enforced through progress hooks for in-process downloads
+      and through a per-process --limit-rate share for yt-dlp subprocesses
+    - requests/sec is enforced before every search and download
+    - an HTTP 429 pauses all new requests with exponential backoff
+    """
+
+    def __init__(self, bytes_per_sec: float = 0, requests_per_sec: float = 0):
+        self.bytes = TokenBucket(bytes_per_sec)
+        self.requests = TokenBucket(requests_per_sec, burst=2.0)
+        self.active_downloads = 0
+        self.backoff = 0
+        self.paused_until = 0
+        self.throttled_count = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'DownloadGovernor':
+        return cls(parse_rate(DEFAULT_BYTES_PER_SEC), parse_rate(DEFAULT_REQUESTS_PER_SEC))
+
+    def set_limits(self, bytes_per_sec: Optional[float] = None,
+                   requests_per_sec: Optional[float] = None):
+        """Change the limits at runtime"""
+        if bytes_per_sec is not None:
+            self.bytes.set_rate(parse_rate(bytes_per_sec))
+        if requests_per_sec is not None:
+            self.requests.set_rate(parse_rate(requests_per_sec))
+
+    def limits(self) -> Dict:
+        """Current limits and backoff state"""
+        with self._lock:
+            paused = max(0.0, self.paused_until - time.time())
+            return {
+                'bytes_per_sec': self.bytes.rate,
+                'requests_per_sec': self.requests.rate,
+                'active_downloads': self.active_downloads,
+                'backoff_seconds': self.backoff,
+                'paused_seconds': round(paused, 1),
+                'throttled_count': self.throttled_count
+            }
+
+    def acquire_request(self):
+        """Wait for any 429 backoff and for a request token"""
+        while True:
+            with self._lock:
+                wait = self.paused_until - time.time()
+            if wait <= 0:
+                break
+            time.sleep(min(wait, 1.0))
+        self.requests.acquire()
+
+    def report_throttled(self):
+        """YouTube answered 429: pause everyone, doubling the pause each time"""
+        with self._lock:
+            self.backoff = min(BACKOFF_MAX, self.backoff * 2 if self.backoff else BACKOFF_BASE)
+            self.paused_until = max(self.paused_until, time.time() + self.backoff)
+            self.throttled_count += 1
+        print(f"YouTube 限流 (429)，暫停 {self.backoff} 秒")
+
+    def report_success(self):
+        """A request went through, reset the backoff"""
+        with self._lock:
+            self.backoff = 0
+
+    def rate_share(self) -> float:
+        """Bandwidth share of one download, used for yt-dlp --limit-rate"""
+        with self._lock:
+            active = max(1, self.active_downloads)
+        return self.bytes.rate / active if self.bytes.rate else 0
+
+    def download_started(self):
+        with self._lock:
+            self.active_downloads += 1
+
+    def download_finished(self):
+        with self._lock:
+            self.active_downloads = max(0, self.active_downloads - 1)
+
+    def byte_hook(self) -> Callable[[Dict], None]:
+        """
+        Get a progress hook that charges downloaded bytes to the bucket
+
+        yt-dlp calls progress hooks from its download loop, so blocking here
+        slows the transfer down to the shared rate.
+        """
+        last = {'bytes': 0}
+
+        def hook(d: Dict):
+            if d.get('status') != 'downloading' or not self.bytes.rate:
+                return
+            downloaded = d.get('downloaded_bytes') or 0
+            delta = downloaded - last['bytes']
+            last['bytes'] = downloaded
+            if delta > 0:
+                self.bytes.acquire(delta)
+        return hook
+
+
+# 程序內所有下載共用的限速器
+governor = DownloadGovernor.from_env()
@@ -0,0 +1,214 @@
+"""
+Spotify Web Player Response Capture
+攔截網頁播放器自己的歌單 JSON 回應，直接解析歌曲並依 offset 分頁，不必捲動頁面
+"""
+
+import asyncio
+import json
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlsplit, urlunsplit
+from track_identity import assign_track_keys
+
+
+# GraphQL endpoint the web player loads playlist contents from
+PATHFINDER = 'api-partner.spotify.com/pathfinder/'
+PLAYLIST_OPERATIONS = ('fetchPlaylist', 'fetchPlaylistContents', 'fetchPlaylistWithGatedEntityRelations')
+
+# Items requested per replayed page
+PAGE_LIMIT = 100
+
+# Seconds to wait for the player's first playlist response
+FIRST_RESPONSE_TIMEOUT = 10
+
+# Headers the browser sets itself
+_SKIP_HEADERS = {'host', 'content-length', 'cookie', 'connection', 'accept-encoding'}
+
+
+class PayloadShapeError(ValueError):
+    """The player's response no longer looks like we expect"""
+
+
+def playlist_id_from_url(playlist_url: str) -> str:
+    """Get the playlist ID out of an open.spotify.com URL"""
+    return playlist_url.split('playlist/')[-1].split('?')[0].split('/')[0]
+
+
+def parse_playlist_page(payload: dict) -> Tuple[str, int, List[dict]]:
+    """
+    Read one playlist response
+
+    Returns:
+        (playlist name, total item count, raw items)
+
+    Raises:
+        PayloadShapeError: when the payload is not shaped like a playlist page
+    """
+    try:
+        playlist = payload['data']['playlistV2']
+        content = playlist['content']
+        return playlist.get('name') or '', int(content['totalCount']), list(content['items'])
+    except (KeyError, TypeError, ValueError) as e:
+        raise PayloadShapeError(f'unexpected playlist payload: {e!r}') from e
+
+
+def parse_item(item: dict) -> Optional[dict]:
+    """
+    Convert a playlist item into a track dictionary (without 'index')
+
+    Returns None for items that are not tracks (podcast episodes, local or
+    removed tracks).
+
+    Raises:
+        PayloadShapeError: when the item is not shaped like a playlist item
+    """
+    try:
+        data = item['itemV2']['data']
+        if data.get('__typename') != 'Track':
+            return None
+        name = data['name']
+        artists = [artist['profile']['name'] for artist in data['artists']['items']]
+        uri = data.get('uri') or ''
+        duration = (data.get('trackDuration') or {}).get('totalMilliseconds')
+    except (KeyError, TypeError, AttributeError) as e:
+        raise PayloadShapeError(f'unexpected playlist item: {e!r}') from e
+
+    return {
+        'name': name,
+        'artists': artists,
+        'search_query': f"{name} {' '.join(artists)}",
+        'spotify_id': uri.split(':')[-1] if uri.startswith('spotify:track:') else None,
+        'duration_ms': duration
+    }
+
+
+def _request_parts(request) -> Tuple[Optional[str], dict, Optional[dict]]:
+    """operationName, variables and (for POST) the JSON body of a pathfinder request"""
+    if request.method == 'POST':
+        try:
+            body = request.post_data_json or {}
+        except Exception:
+            return None, {}, None
+        return body.get('operationName'), body.get('variables') or {}, body
+    query = parse_qs(urlsplit(request.url).query)
+    try:
+        variables = json.loads(query.get('variables', ['{}'])[0])
+    except ValueError:
+        variables = {}
+    return query.get('operationName', [None])[0], variables, None
+
+
+class PlaylistCapture:
+    """
+    Collect a playlist from the web player's own JSON responses
+
+    Create it right after the page and before page.goto(), so the first
+    playlist response is seen. playlist() then asks the same endpoint for
+    the remaining offsets with the player's own headers, instead of
+    scrolling the track list.
+    """
+
+    def __init__(self, page, playlist_url: str):
+        self.page = page
+        self.playlist_url = playlist_url
+        self.playlist_uri = f'spotify:playlist:{playlist_id_from_url(playlist_url)}'
+        self.pages = {}  # offset -> payload
+        self.template = None  # (url, method, headers, body) of a playlist request
+        page.on('response', self._on_response)
+
+    async def _on_response(self, response):
+        if PATHFINDER not in response.url:
+            return
+        request = response.request
+        operation, variables, body = _request_parts(request)
+        if operation not in PLAYLIST_OPERATIONS or variables.get('uri') != self.playlist_uri:
+            return
+        try:
+            payload = await response.json()
+            headers = await request.all_headers()
+        except Exception:
+            return
+        if self.template is None:
+            headers = {k: v for k, v in headers.items()
+                       if k.lower() not in _SKIP_HEADERS and not k.startswith(':')}
+            self.template = (request.url, request.method, headers, body)
+        self.pages.setdefault(int(variables.get('offset') or 0), payload)
+
+    async def _fetch(self, offset: int, limit: int = PAGE_LIMIT) -> dict:
+        """Replay the captured request for another offset"""
+        url, method, headers, body = self.template
+        if method == 'POST':
+            body = dict(body, variables=dict(body['variables'], offset=offset, limit=limit))
+            response = await self.page.request.post(url, headers=headers, data=json.dumps(body))
+        else:
+            parts = urlsplit(url)
+            query = parse_qs(parts.query)
+            variables = dict(json.loads(query['variables'][0]), offset=offset, limit=limit)
+            query['variables'] = [json.dumps(variables, separators=(',', ':'))]
+            url = urlunsplit(parts._replace(query=urlencode(query, doseq=True)))
+            response = await self.page.request.get(url, headers=headers)
+        if not response.ok:
+            raise RuntimeError(f'HTTP {response.status} for offset {offset}')
+        return await response.json()
+
+    async def playlist(self, timeout: float = FIRST_RESPONSE_TIMEOUT) -> Optional[dict]:
+        """
+        Get the whole playlist from the captured responses
+
+        Returns:
+            {'playlist_name', 'tracks'} with indexed tracks, or None when no
+            playlist response was seen or its shape is unknown (the caller
+            then falls back to scraping the DOM)
+        """
+        waited = 0.0
+        while not self.pages and waited < timeout:
+            await asyncio.sleep(0.2)
+            waited += 0.2
+        if not self.pages or self.template is None:
+            print("未攔截到歌單資料，改用畫面抓取")
+            return None
+
+        try:
+            first = self.pages.get(0) or await self._fetch(0)
+            name, total, items = parse_playlist_page(first)
+            offsets = range(len(items), total, PAGE_LIMIT)
+            print(f"已攔截歌單資料，共 {total} 首，另外請求 {len(offsets)} 頁...")
+            for page in await asyncio.gather(*(self._fetch(offset) for offset in offsets)):
+                items.extend(parse_playlist_page(page)[2])
+            parsed = [parse_item(item) for item in items]
+        except Exception as e:
+            print(f"歌單資料格式無法解析，改用畫面抓取: {e}")
+            return None
+
+        if len(items) < total:
+            print(f"警告：只取得 {len(items)}/{total} 個項目")
+
+        tracks = []
+        for track in parsed:
+            if track:
+                tracks.append({'index': len(tracks) + 1, **track})
+        return {'playlist_name': name, 'tracks': tracks}
+
+    async def result(self) -> Optional[dict]:
+        """
+        Scraper result built from the captured playlist
+
+        Closes the page when it succeeds; the scrapers call this before
+        scrolling the track list, which is much slower.
+
+        Returns:
+            {'playlist_name', 'playlist_url', 'total_tracks', 'tracks'} with
+            track keys assigned, or None to fall back to scraping the DOM
+        """
+        intercepted = await self.playlist()
+        if not intercepted:
+            return None
+        await self.page.close()
+        playlist_name = intercepted['playlist_name'] or "Spotify Playlist"
+        tracks = assign_track_keys(intercepted['tracks'])
+        print(f"歌單名稱: {playlist_name}")
+        return {
+            'playlist_name': playlist_name,
+            'playlist_url': self.playlist_url,
+            'total_tracks': len(tracks),
+            'tracks': tracks
+        }
@@ -4,99 +4,113 @@ Spotify Playlist Scraper - Memory Only Version
 """
 
 import asyncio
-from playwright.async_api import async_playwright
+from browser_pool import browser_context
+from response_capture import PlaylistCapture
+from track_identity import spotify_id_from_url, assign_track_keys
 
 
-async def scrape_playlist_to_memory(playlist_url: str) -> dict:
+async def scrape_playlist_to_memory(playlist_url: str, context=None) -> dict:
     """
     Scrape Spotify playlist and return data (no storage)
+    
+    Args:
+        playlist_url: Spotify playlist URL
+        context: Browser context to use (e.g. from browser_pool); a one-off
+            browser is launched when omitted
     """
     
-    async with async_playwright() as p:
-        print("正在啟動瀏覽器...")
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context(
-            viewport={'width': 1280, 'height': 900},
-            user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        )
-        page = await context.new_page()
-        
-        print(f"正在載入歌單: {playlist_url}")
-        await page.goto(playlist_url)
-        await page.wait_for_load_state('networkidle')
-        await asyncio.sleep(3)
-        
-        # Get playlist name
-        playlist_name = "Spotify Playlist"
-        try:
-            elem = await page.query_selector('h1[data-testid="entityTitle"]')
-            if elem:
-                playlist_name = await elem.inner_text()
-            else:
-                title = await page.title()
-                playlist_name = title.split(' - playlist by')[0] if ' - playlist by' in title else "Spotify Playlist"
-        except:
-            pass
-        
-        print(f"歌單名稱: {playlist_name}")
-        print("正在使用鍵盤導航收集歌曲...")
-        
-        # Click on the tracklist to focus it
-        try:
-            tracklist = await page.query_selector('[data-testid="playlist-tracklist"]')
-            if tracklist:
-                await tracklist.click()
-                await asyncio.sleep(0.5)
-        except:
-            pass
-        
-        # Press Home to go to top
-        await page.keyboard.press('Home')
-        await asyncio.sleep(1)
-        
-        # Collect tracks by pressing PageDown repeatedly
-        collected = {}
-        no_new_count = 0
-        max_no_new = 30
-        
-        while no_new_count < max_no_new:
-            # Get current visible tracks
-            rows = await page.query_selector_all('[data-testid="tracklist-row"]')
-            
-            for row in rows:
-                try:
-                    # Get track name
-                    title_elem = await row.query_selector('[data-testid="internal-track-link"]')
-                    if not title_elem:
-                        continue
-                    title = await title_elem.inner_text()
-                    title = title.strip()
-                    
-                    # Get artists
-                    artist_elems = await row.query_selector_all('a[href*="/artist/"]')
-                    artists = []
-                    for ae in artist_elems:
-                        name = await ae.inner_text()
-                        if name and name.strip():
-                            artists.append(name.strip())
-                    
-                    key = f"{title}|||{'|||'.join(artists)}"
-                    if key not in collected:
-                        collected[key] = {
-                            'title': title,
-                            'artists': artists
-                        }
-                        print(f"  [{len(collected)}] {title} - {', '.join(artists)}")
-                        no_new_count = 0
-                except:
+    if context is None:
+        async with browser_context() as context:
+            return await scrape_playlist_to_memory(playlist_url, context)
+    
+    page = await context.new_page()
+    capture = PlaylistCapture(page, playlist_url)
+    
+    print(f"正在載入歌單: {playlist_url}")
+    await page.goto(playlist_url)
+    await page.wait_for_load_state('networkidle')
+    
+    result = await capture.result()
+    if result:
+        print(f"\n完成！共抓取 {result['total_tracks']} 首歌曲")
+        return result
+    
+    await asyncio.sleep(3)
+    
+    # Get playlist name
+    playlist_name = "Spotify Playlist"
+    try:
+        elem = await page.query_selector('h1[data-testid="entityTitle"]')
+        if elem:
+            playlist_name = await elem.inner_text()
+        else:
+            title = await page.title()
+            playlist_name = title.split(' - playlist by')[0] if ' - playlist by' in title else "Spotify Playlist"
+    except:
+        pass
+    
+    print(f"歌單名稱: {playlist_name}")
+    print("正在使用鍵盤導航收集歌曲...")
+    
+    # Click on the tracklist to focus it
+    try:
+        tracklist = await page.query_selector('[data-testid="playlist-tracklist"]')
+        if tracklist:
+            await tracklist.click()
+            await asyncio.sleep(0.5)
+    except:
+        pass
+    
+    # Press Home to go to top
+    await page.keyboard.press('Home')
+    await asyncio.sleep(1)
+    
+    # Collect tracks by pressing PageDown repeatedly
+    collected = {}
+    no_new_count = 0
+    max_no_new = 30
+    
+    while no_new_count < max_no_new:
+        # Get current visible tracks
+        rows = await page.query_selector_all('[data-testid="tracklist-row"]')
+    
+        for row in rows:
+            try:
+                # Get track name
+                title_elem = await row.query_selector('[data-testid="internal-track-link"]')
+                if not title_elem:
                     continue
-            
-            # Scroll down using keyboard
-            await page.keyboard.press('PageDown')
-            await asyncio.sleep(0.3)
-            no_new_count += 1
-        
-        await browser.close()
+                title = await title_elem.inner_text()
+                title = title.strip()
+                spotify_id = spotify_id_from_url(await title_elem.get_attribute('href'))
+    
+                # Get artists
+                artist_elems = await row.query_selector_all('a[href*="/artist/"]')
+                artists = []
+                for ae in artist_elems:
+                    name = await ae.inner_text()
+                    if name and name.strip():
+                        artists.append(name.strip())
+    
+                # Same title and artists can still be different songs
+                key = spotify_id or f"{title}|||{'|||'.join(artists)}"
+                if key not in collected:
+                    collected[key] = {
+                        'title': title,
+                        'artists': artists,
+                        'spotify_id': spotify_id
+                    }
+                    print(f"  [{len(collected)}] {title} - {', '.join(artists)}")
+                    no_new_count = 0
+            except:
+                continue
+    
+        # Scroll down using keyboard
+        await page.keyboard.press('PageDown')
+        await asyncio.sleep(0.3)
+        no_new_count += 1
+    
+    await page.close()
     
     # Format tracks
     tracks = []
@@ -105,8 +119,10 @@ async def scrape_playlist_to_memory(playlist_url: str) -> dict:
             'index': i + 1,
             'name': data['title'],
             'artists': data['artists'],
-            'search_query': f"{data['title']} {' '.join(data['artists'])}"
+            'search_query': f"{data['title']} {' '.join(data['artists'])}",
+            'spotify_id': data['spotify_id']
         })
+    assign_track_keys(tracks)
     
     result = {
         'playlist_name': playlist_name,
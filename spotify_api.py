@@ -5,13 +5,37 @@ Uses official Spotify API via spotipy to fetch playlist data
 
 import os
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
+from track_identity import assign_track_keys
+from database import get_playlist_by_url, save_playlist
+
+
+# Largest page the playlist items endpoint returns
+PAGE_SIZE = 100
+
+# Pages fetched at the same time
+FETCH_WORKERS = int(os.environ.get('SPOTIFY_FETCH_WORKERS', '8'))
+
+# Clients per credential pair, so the client-credentials token is reused
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Only request the track fields we use
+ITEM_FIELDS = 'items(track(id,name,duration_ms,artists(name)))'
+PLAYLIST_FIELDS = f'name,snapshot_id,tracks(total,{ITEM_FIELDS})'
 
 
 def get_spotify_client(client_id: str, client_secret: str) -> spotipy.Spotify:
     """
-    Create an authenticated Spotify client
+    Get an authenticated Spotify client
+    
+    The client is created once per credential pair and kept for the life
+    of the process; its credentials manager holds the access token and only
+    requests a new one when it expires.
     
     Args:
         client_id: Spotify API client ID
@@ -20,11 +44,16 @@ def get_spotify_client(client_id: str, client_secret: str) -> spotipy.Spotify:
     Returns:
         Authenticated Spotify client
     """
-    client_credentials_manager = SpotifyClientCredentials(
-        client_id=client_id,
-        client_secret=client_secret
-    )
-    return spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+    with _clients_lock:
+        client = _clients.get((client_id, client_secret))
+        if client is None:
+            client_credentials_manager = SpotifyClientCredentials(
+                client_id=client_id,
+                client_secret=client_secret
+            )
+            client = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+            _clients[(client_id, client_secret)] = client
+        return client
 
 
 def extract_playlist_id(playlist_url: str) -> str:
@@ -39,7 +68,92 @@ def extract_playlist_id(playlist_url: str) -> str:
     return playlist_url
 
 
-def fetch_playlist_tracks(client_id: str, client_secret: str, playlist_url: str) -> dict:
+def fetch_playlist_pages(sp: spotipy.Spotify, playlist_id: str,
+                         workers: int = FETCH_WORKERS) -> dict:
+    """
+    Fetch a playlist's name and all its items
+    
+    The first request returns the name, the total and the first page; the
+    remaining pages are then requested by offset at the same time, each
+    thread with its own client sharing the same access token.
+    
+    Args:
+        sp: Authenticated Spotify client
+        playlist_id: Spotify playlist ID
+        workers: Pages fetched at the same time (1 = one after another)
+        
+    Returns:
+        Dictionary with 'name', 'snapshot_id', 'total' and 'items' in playlist order
+    """
+    playlist = sp.playlist(playlist_id, fields=PLAYLIST_FIELDS, additional_types=('track',))
+    total = playlist['tracks']['total']
+    items = list(playlist['tracks']['items'])
+    
+    local = threading.local()
+    
+    def fetch_page(offset: int) -> List[dict]:
+        # requests sessions are not meant to be shared between threads
+        if not hasattr(local, 'sp'):
+            local.sp = spotipy.Spotify(auth_manager=sp.auth_manager)
+        page = local.sp.playlist_items(playlist_id, fields=ITEM_FIELDS, limit=PAGE_SIZE,
+                                       offset=offset, additional_types=('track',))
+        return page['items']
+    
+    offsets = range(len(items), total, PAGE_SIZE)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for page in pool.map(fetch_page, offsets):
+            items.extend(page)
+    
+    return {'name': playlist['name'], 'snapshot_id': playlist.get('snapshot_id'),
+            'total': total, 'items': items}
+
+
+def track_info(track: dict, index: int) -> dict:
+    """Convert a Spotify track object into a track dictionary"""
+    track_name = track.get('name') or 'Unknown'
+    artists = [artist['name'] for artist in track.get('artists') or []]
+    return {
+        'index': index,
+        'name': track_name,
+        'artists': artists,
+        'search_query': f"{track_name} {' '.join(artists)}",
+        'spotify_id': track.get('id'),
+        'duration_ms': track.get('duration_ms')
+    }
+
+
+def save_tracks_json(result: dict, output_file: Optional[str] = 'spotify_tracks.json'):
+    """Write the fetched playlist to the JSON file the other tools read (None to skip)"""
+    if not output_file:
+        return
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\n歌曲資料已儲存至 {output_file}")
+
+
+def get_unchanged_playlist(sp: spotipy.Spotify, playlist_id: str,
+                           playlist_url: str) -> Optional[dict]:
+    """
+    Get the saved copy of a playlist if Spotify still has the same version
+    
+    Asks only for the playlist's snapshot_id, which changes whenever the
+    playlist is edited, and compares it with the one saved last time.
+    
+    Returns:
+        The saved playlist dictionary, or None when it must be fetched again
+    """
+    cached = get_playlist_by_url(playlist_url)
+    if not cached or not cached.get('snapshot_id'):
+        return None
+    current = sp.playlist(playlist_id, fields='snapshot_id')
+    if current.get('snapshot_id') != cached['snapshot_id']:
+        return None
+    return cached
+
+
+def fetch_playlist_tracks(client_id: str, client_secret: str, playlist_url: str,
+                          workers: Optional[int] = None, use_cache: bool = True,
+                          output_file: Optional[str] = 'spotify_tracks.json') -> dict:
     """
     Fetch all tracks from a Spotify playlist using the API
     
@@ -47,53 +161,49 @@ def fetch_playlist_tracks(client_id: str, client_secret: str, playlist_url: str)
         client_id: Spotify API client ID
         client_secret: Spotify API client secret
         playlist_url: Spotify playlist URL
+        workers: Pages fetched at the same time (default: SPOTIFY_FETCH_WORKERS)
+        use_cache: Reuse the saved tracks when the playlist's snapshot_id is unchanged
+        output_file: JSON file the tracks are written to (None to skip)
         
     Returns:
         Dictionary with playlist info and tracks
     """
     sp = get_spotify_client(client_id, client_secret)
     playlist_id = extract_playlist_id(playlist_url)
+    # One URL per playlist, whatever share parameters the link had
+    canonical_url = f"https://open.spotify.com/playlist/{playlist_id}"
+    
+    if use_cache:
+        cached = get_unchanged_playlist(sp, playlist_id, canonical_url)
+        if cached:
+            print(f"歌單未變更（snapshot {cached['snapshot_id']}），使用已儲存的 {cached['total_tracks']} 首歌曲")
+            result = {
+                'playlist_name': cached['playlist_name'],
+                'playlist_url': playlist_url,
+                'total_tracks': cached['total_tracks'],
+                'tracks': cached['tracks']
+            }
+            save_tracks_json(result, output_file)
+            return result
     
     print(f"正在使用 Spotify API 抓取歌單...")
     
-    # Get playlist info
-    playlist = sp.playlist(playlist_id)
+    playlist = fetch_playlist_pages(sp, playlist_id, workers or FETCH_WORKERS)
     playlist_name = playlist['name']
-    total_tracks = playlist['tracks']['total']
     
     print(f"歌單名稱: {playlist_name}")
-    print(f"總歌曲數: {total_tracks}")
+    print(f"總歌曲數: {playlist['total']}")
     
-    # Fetch all tracks (paginated)
     tracks = []
-    results = playlist['tracks']
-    
-    while True:
-        for i, item in enumerate(results['items']):
-            track = item.get('track')
-            if track is None:
-                continue
-                
-            track_name = track.get('name', 'Unknown')
-            artists = [artist['name'] for artist in track.get('artists', [])]
-            
-            track_info = {
-                'index': len(tracks) + 1,
-                'name': track_name,
-                'artists': artists,
-                'search_query': f"{track_name} {' '.join(artists)}",
-                'spotify_id': track.get('id'),
-                'duration_ms': track.get('duration_ms')
-            }
-            tracks.append(track_info)
-            print(f"  [{track_info['index']}] {track_name} - {', '.join(artists)}")
-        
-        # Check if there are more tracks
-        if results['next']:
-            results = sp.next(results)
-        else:
-            break
+    for item in playlist['items']:
+        track = item.get('track')
+        if track is None:
+            continue
+        info = track_info(track, len(tracks) + 1)
+        tracks.append(info)
+        print(f"  [{info['index']}] {info['name']} - {', '.join(info['artists'])}")
     
+    assign_track_keys(tracks)
     result = {
         'playlist_name': playlist_name,
         'playlist_url': playlist_url,
@@ -101,11 +211,9 @@ def fetch_playlist_tracks(client_id: str, client_secret: str, playlist_url: str)
         'tracks': tracks
     }
     
-    # Save to JSON file
-    output_file = 'spotify_tracks.json'
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(result, f, ensure_ascii=False, indent=2)
-    print(f"\n歌曲資料已儲存至 {output_file}")
+    # Save to JSON file, and to the database with the snapshot for next time
+    save_tracks_json(result, output_file)
+    save_playlist(playlist_name, canonical_url, tracks, snapshot_id=playlist['snapshot_id'])
     
     return result
 
@@ -4,140 +4,159 @@ Scrapes song information from public Spotify playlists using Playwright
 """
 
 import asyncio
-from playwright.async_api import async_playwright
+from browser_pool import browser_context
 from database import save_playlist
+from response_capture import PlaylistCapture
+from track_identity import spotify_id_from_url, assign_track_keys
 
 
-async def scrape_spotify_playlist(playlist_url: str, headless: bool = False) -> dict:
+async def scrape_spotify_playlist(playlist_url: str, headless: bool = False, context=None) -> dict:
     """
     Scrape a Spotify playlist and return song information.
+    
+    Args:
+        playlist_url: Spotify playlist URL
+        headless: Hide the one-off browser window
+        context: Browser context to use (e.g. from browser_pool); a one-off
+            browser is launched when omitted
     """
+    if context is None:
+        async with browser_context(headless=headless) as context:
+            return await scrape_spotify_playlist(playlist_url, headless, context)
+    
     tracks = []
     playlist_name = ""
     
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=headless)
-        context = await browser.new_context(
-            user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            viewport={'width': 1280, 'height': 900}
-        )
-        page = await context.new_page()
-        
-        print(f"正在載入 Spotify 歌單...")
-        await page.goto(playlist_url)
-        await page.wait_for_load_state('networkidle')
-        await asyncio.sleep(3)
-        
-        # Get playlist name
-        try:
-            playlist_name_elem = await page.query_selector('h1[data-testid="entityTitle"]')
-            if playlist_name_elem:
-                playlist_name = await playlist_name_elem.inner_text()
-            else:
-                title = await page.title()
-                playlist_name = title.split(' - playlist by')[0] if ' - playlist by' in title else "Spotify Playlist"
-        except:
-            playlist_name = "Spotify Playlist"
-        
-        print(f"歌單名稱: {playlist_name}")
-        print("正在載入所有歌曲...")
-        
-        # Scroll to load all tracks
-        last_count = 0
-        no_change = 0
-        
-        while no_change < 15:
-            await page.evaluate('window.scrollTo(0, document.body.scrollHeight)')
-            await asyncio.sleep(0.5)
-            await page.keyboard.press('End')
-            await asyncio.sleep(0.5)
-            
-            rows = await page.query_selector_all('[data-testid="tracklist-row"]')
-            current = len(rows)
-            
-            if current == last_count:
-                no_change += 1
-                for _ in range(3):
-                    await page.keyboard.press('PageDown')
-                    await asyncio.sleep(0.2)
-            else:
-                no_change = 0
-                last_count = current
-                print(f"  已載入 {current} 首歌曲...")
-        
-        print(f"\n載入完成，開始收集 {last_count} 首歌曲...")
-        
-        # Go back to top
-        await page.keyboard.press('Home')
-        await asyncio.sleep(1)
-        await page.evaluate('window.scrollTo(0, 0)')
-        await asyncio.sleep(1)
-        
-        # Collect all tracks by scrolling through
-        seen_tracks = set()  # Track unique identifiers
-        
-        for scroll_round in range(100):
-            rows = await page.query_selector_all('[data-testid="tracklist-row"]')
-            
-            for row in rows:
-                try:
-                    # Get track name - try multiple selectors
-                    track_name = None
-                    
-                    # Try: div inside the link
-                    elem = await row.query_selector('a[data-testid="internal-track-link"] div')
+    page = await context.new_page()
+    capture = PlaylistCapture(page, playlist_url)
+    
+    print(f"正在載入 Spotify 歌單...")
+    await page.goto(playlist_url)
+    await page.wait_for_load_state('networkidle')
+    
+    result = await capture.result()
+    if result:
+        # 儲存到 SQLite 資料庫
+        save_playlist(result['playlist_name'], playlist_url, result['tracks'])
+        print(f"\n完成！共抓取 {result['total_tracks']} 首歌曲")
+        return result
+    
+    await asyncio.sleep(3)
+    
+    # Get playlist name
+    try:
+        playlist_name_elem = await page.query_selector('h1[data-testid="entityTitle"]')
+        if playlist_name_elem:
+            playlist_name = await playlist_name_elem.inner_text()
+        else:
+            title = await page.title()
+            playlist_name = title.split(' - playlist by')[0] if ' - playlist by' in title else "Spotify Playlist"
+    except:
+        playlist_name = "Spotify Playlist"
+    
+    print(f"歌單名稱: {playlist_name}")
+    print("正在載入所有歌曲...")
+    
+    # Scroll to load all tracks
+    last_count = 0
+    no_change = 0
+    
+    while no_change < 15:
+        await page.evaluate('window.scrollTo(0, document.body.scrollHeight)')
+        await asyncio.sleep(0.5)
+        await page.keyboard.press('End')
+        await asyncio.sleep(0.5)
+    
+        rows = await page.query_selector_all('[data-testid="tracklist-row"]')
+        current = len(rows)
+    
+        if current == last_count:
+            no_change += 1
+            for _ in range(3):
+                await page.keyboard.press('PageDown')
+                await asyncio.sleep(0.2)
+        else:
+            no_change = 0
+            last_count = current
+            print(f"  已載入 {current} 首歌曲...")
+    
+    print(f"\n載入完成，開始收集 {last_count} 首歌曲...")
+    
+    # Go back to top
+    await page.keyboard.press('Home')
+    await asyncio.sleep(1)
+    await page.evaluate('window.scrollTo(0, 0)')
+    await asyncio.sleep(1)
+    
+    # Collect all tracks by scrolling through
+    seen_tracks = set()  # Track unique identifiers
+    
+    for scroll_round in range(100):
+        rows = await page.query_selector_all('[data-testid="tracklist-row"]')
+    
+        for row in rows:
+            try:
+                # Get track name - try multiple selectors
+                track_name = None
+    
+                # Try: div inside the link
+                elem = await row.query_selector('a[data-testid="internal-track-link"] div')
+                if elem:
+                    track_name = await elem.inner_text()
+    
+                # Fallback: the link itself
+                if not track_name:
+                    elem = await row.query_selector('a[data-testid="internal-track-link"]')
                     if elem:
                         track_name = await elem.inner_text()
-                    
-                    # Fallback: the link itself
-                    if not track_name:
-                        elem = await row.query_selector('a[data-testid="internal-track-link"]')
-                        if elem:
-                            track_name = await elem.inner_text()
-                    
-                    if not track_name:
-                        continue
-                    
-                    track_name = track_name.strip()
-                    
-                    # Get artists
-                    artist_elems = await row.query_selector_all('span a[href^="/artist/"]')
-                    if not artist_elems:
-                        artist_elems = await row.query_selector_all('a[href^="/artist/"]')
-                    
-                    artists = []
-                    for ae in artist_elems:
-                        name = await ae.inner_text()
-                        if name and name.strip() and name.strip() not in artists:
-                            artists.append(name.strip())
-                    
-                    # Create unique key
-                    key = f"{track_name}|{'|'.join(artists)}"
-                    
-                    if key not in seen_tracks:
-                        seen_tracks.add(key)
-                        tracks.append({
-                            'index': len(tracks) + 1,
-                            'name': track_name,
-                            'artists': artists,
-                            'search_query': f"{track_name} {' '.join(artists)}"
-                        })
-                        print(f"  [{len(tracks)}] {track_name} - {', '.join(artists)}")
-                        
-                except Exception as e:
+    
+                if not track_name:
                     continue
-            
-            # Check if we have all tracks
-            if len(tracks) >= last_count:
-                break
-            
-            # Scroll down
-            for _ in range(2):
-                await page.keyboard.press('PageDown')
-                await asyncio.sleep(0.3)
-        
-        await browser.close()
     
+                track_name = track_name.strip()
+                link = await row.query_selector('a[data-testid="internal-track-link"]')
+                spotify_id = spotify_id_from_url(await link.get_attribute('href')) if link else None
+    
+                # Get artists
+                artist_elems = await row.query_selector_all('span a[href^="/artist/"]')
+                if not artist_elems:
+                    artist_elems = await row.query_selector_all('a[href^="/artist/"]')
+    
+                artists = []
+                for ae in artist_elems:
+                    name = await ae.inner_text()
+                    if name and name.strip() and name.strip() not in artists:
+                        artists.append(name.strip())
+    
+                # Create unique key (same title and artists can still be different songs)
+                key = spotify_id or f"{track_name}|{'|'.join(artists)}"
+    
+                if key not in seen_tracks:
+                    seen_tracks.add(key)
+                    tracks.append({
+                        'index': len(tracks) + 1,
+                        'name': track_name,
+                        'artists': artists,
+                        'search_query': f"{track_name} {' '.join(artists)}",
+                        'spotify_id': spotify_id
+                    })
+                    print(f"  [{len(tracks)}] {track_name} - {', '.join(artists)}")
+    
+            except Exception as e:
+                continue
+    
+        # Check if we have all tracks
+        if len(tracks) >= last_count:
+            break
+    
+        # Scroll down
+        for _ in range(2):
+            await page.keyboard.press('PageDown')
+            await asyncio.sleep(0.3)
+    
+    await page.close()
+    
+    assign_track_keys(tracks)
     result = {
         'playlist_name': playlist_name,
         'playlist_url': playlist_url,
@@ -0,0 +1,42 @@
+import pytest
+
+import database
+
+
+def test_get_current_playlist_reads_back_saved_playlist(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_PATH', tmp_path / 'spotify_tracks.db')
+    database.init_db()
+
+    tracks = [
+        {'name': 'Song A', 'artists': ['Artist 1'], 'spotify_id': '4uLU6hMCjMI75M1A2tKUQC',
+         'duration_ms': 215000},
+        {'name': 'Song B', 'artists': ['Artist 2', 'Artist 3']},
+    ]
+    database.save_playlist('My List', 'https://open.spotify.com/playlist/XYZ', tracks,
+                           snapshot_id='snap-1')
+
+    playlist = database.get_current_playlist()
+
+    assert playlist['playlist_name'] == 'My List'
+    assert playlist['snapshot_id'] == 'snap-1'
+    assert playlist['total_tracks'] == 2
+    first, second = playlist['tracks']
+    assert first['spotify_id'] == '4uLU6hMCjMI75M1A2tKUQC'
+    assert first['duration_ms'] == 215000
+    assert first['track_key'] == 'spotify:4uLU6hMCjMI75M1A2tKUQC'
+    assert second['artists'] == ['Artist 2', 'Artist 3']
+    assert second['track_key'].startswith('h:')
+
+
+def test_job_updates_reject_unknown_states(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_PATH', tmp_path / 'spotify_tracks.db')
+    database.init_db()
+    job_id = database.create_job('download', {}, [{'name': 'Song A'}])
+
+    with pytest.raises(ValueError):
+        database.update_job(job_id, state='finished')
+    with pytest.raises(ValueError):
+        database.update_job_item(job_id, 0, 'skipped')
+
+    database.update_job_item(job_id, 0, 'done')
+    assert [item['state'] for item in database.get_job_items(job_id)] == ['done']
@@ -0,0 +1,36 @@
+import database
+import youtube_quota
+
+
+def test_reservations_cannot_overrun_the_daily_quota(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_PATH', tmp_path / 'spotify_tracks.db')
+    monkeypatch.setattr(youtube_quota, 'DAILY_QUOTA', 300)
+    database.init_db()
+
+    assert youtube_quota.reserve(150)
+    assert youtube_quota.reserve(150)
+    # Both passed can_afford() on their own, but not together with a third
+    assert youtube_quota.can_afford(150)
+    assert not youtube_quota.reserve(150)
+
+    youtube_quota.release(150)
+    assert youtube_quota.reserve(150)
+
+    youtube_quota.release(300)
+    assert youtube_quota.remaining_quota() == 300
+
+
+def test_spending_a_held_reservation_is_not_counted_twice(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_PATH', tmp_path / 'spotify_tracks.db')
+    monkeypatch.setattr(youtube_quota, 'DAILY_QUOTA', 300)
+    database.init_db()
+
+    assert youtube_quota.reserve(150)
+    youtube_quota.hold(150)
+    youtube_quota.spend('search.list')
+    assert youtube_quota.drop_hold() == 50
+
+    # 100 used and 50 still reserved leave room for another 150
+    assert youtube_quota.reserve(150)
+    youtube_quota.release(200)
+    assert youtube_quota.remaining_quota() == 200
@@ -0,0 +1,75 @@
+"""
+Track Identity
+歌曲的穩定識別碼：抓取時指定一次，之後比對、續傳、下載索引都用它當作鍵值
+"""
+
+import hashlib
+import re
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+_TRACK_URL = re.compile(r'/track/([A-Za-z0-9]{22})')
+
+
+def spotify_id_from_url(url: Optional[str]) -> Optional[str]:
+    """Get the Spotify track id from a '/track/<id>' link"""
+    match = _TRACK_URL.search(url or '')
+    return match.group(1) if match else None
+
+
+def _normalize(text: str) -> str:
+    return ' '.join((text or '').lower().split())
+
+
+def make_track_key(track: dict, index: Optional[int] = None) -> str:
+    """
+    Build the canonical key of a track
+
+    The Spotify id when known ('spotify:<id>'), otherwise a hash of the
+    normalized name, artists and playlist index ('h:<hash>'), so two songs
+    with the same title and artist on one playlist still get their own key.
+
+    Args:
+        track: Track dictionary
+        index: Position in the playlist (defaults to track['index'])
+    """
+    if track.get('spotify_id'):
+        return f"spotify:{track['spotify_id']}"
+    if index is None:
+        index = track.get('index')
+    basis = '\x1f'.join([
+        _normalize(track.get('name', '')),
+        ','.join(_normalize(artist) for artist in track.get('artists') or []),
+        str(index or '')
+    ])
+    return 'h:' + hashlib.sha1(basis.encode('utf-8')).hexdigest()[:16]
+
+
+def track_key(track: dict) -> str:
+    """Get the key assigned to a track, computing it for tracks saved before keys existed"""
+    return track.get('track_key') or make_track_key(track)
+
+
+def assign_track_keys(tracks: List[dict]) -> List[dict]:
+    """
+    Give every track its 'track_key' (in place), keeping keys already set
+
+    Scrapers call this once on the final track list; everything downstream
+    reads the key instead of recomputing it.
+    """
+    for position, track in enumerate(tracks, 1):
+        if not track.get('track_key'):
+            track['track_key'] = make_track_key(track, track.get('index') or position)
+    return tracks
+
+
+def index_by_key(entries: Iterable, get_track: Callable[[object], dict] = lambda entry: entry) -> Dict[str, object]:
+    """
+    Map track keys to entries for O(1) lookups
+
+    Args:
+        entries: Tracks, or result entries holding a track
+        get_track: Gets the track dictionary out of an entry, e.g.
+            lambda entry: entry['track'] for youtube_results.json entries
+    """
+    return {track_key(get_track(entry)): entry for entry in entries}
@@ -0,0 +1,116 @@
+"""
+YouTube Candidate Ranking
+依歌曲長度與標題相似度，從多個 YouTube 搜尋結果中挑出最符合的影片
+"""
+
+import re
+import unicodedata
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+
+
+# Search results compared per track
+CANDIDATE_COUNT = 5
+
+# Below this confidence a match is reported as doubtful
+LOW_CONFIDENCE = 0.5
+
+# Duration difference (seconds) at which the duration score reaches zero
+DURATION_TOLERANCE = 30
+
+# Words that usually mean a different recording than the studio track,
+# unless the Spotify title has them too
+VERSION_WORDS = (
+    'live', 'cover', 'karaoke', 'instrumental', 'remix', 'sped up', 'slowed',
+    'nightcore', 'reverb', '8d', 'loop', 'hour', 'hours', '1 hour', '10 hours',
+    'reaction', 'tutorial', 'lesson', '現場', '翻唱', '伴奏', '純音樂'
+)
+VERSION_PENALTY = 0.5
+
+_ISO_DURATION = re.compile(
+    r'P(?:(?P<days>\d+)D)?(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>\d+)S)?)?'
+)
+
+
+def parse_iso_duration(value: Optional[str]) -> Optional[float]:
+    """Parse an ISO 8601 duration such as 'PT3M25S' into seconds"""
+    match = _ISO_DURATION.fullmatch(value or '')
+    if not value or not match:
+        return None
+    parts = {k: int(v) for k, v in match.groupdict().items() if v}
+    return (parts.get('days', 0) * 86400 + parts.get('hours', 0) * 3600
+            + parts.get('minutes', 0) * 60 + parts.get('seconds', 0))
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, drop accents and punctuation for comparison"""
+    text = unicodedata.normalize('NFKD', text or '').lower()
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'[^\w]+', ' ', text).split())
+
+
+def duration_score(expected_ms: Optional[float], duration: Optional[float]) -> float:
+    """1.0 for the same length, falling to 0 at DURATION_TOLERANCE seconds off"""
+    if not expected_ms or not duration:
+        return 0.5  # unknown, neither good nor bad
+    diff = abs(duration - expected_ms / 1000)
+    return max(0.0, 1 - diff / DURATION_TOLERANCE)
+
+
+def title_score(track: dict, candidate: Dict) -> float:
+    """How well the video title and channel match the track name and artists"""
+    name = normalize_text(track.get('name') or track.get('search_query', ''))
+    title = normalize_text(candidate.get('title', ''))
+    channel = normalize_text(candidate.get('channel', ''))
+    if not name or not title:
+        return 0.0
+
+    words = name.split()
+    coverage = sum(1 for word in words if word in title.split()) / len(words)
+    similarity = SequenceMatcher(None, name, title).ratio()
+
+    artists = [normalize_text(artist) for artist in track.get('artists') or []]
+    if artists:
+        artist = 1.0 if any(a and (a in title or a in channel) for a in artists) else 0.0
+        return 0.5 * coverage + 0.2 * similarity + 0.3 * artist
+    return 0.7 * coverage + 0.3 * similarity
+
+
+def version_penalty(track: dict, candidate: Dict) -> float:
+    """Penalty factor for live versions, covers, loops and the like"""
+    name = f" {normalize_text(track.get('name', ''))} "
+    title = f" {normalize_text(candidate.get('title', ''))} "
+    for word in VERSION_WORDS:
+        if f' {word} ' in title and f' {word} ' not in name:
+            return VERSION_PENALTY
+    return 1.0
+
+
+def score_candidate(track: dict, candidate: Dict, rank: int = 0) -> float:
+    """
+    Confidence (0 to 1) that a search result is the track
+
+    Args:
+        track: Track dictionary, 'duration_ms' and 'artists' are used when present
+        candidate: Search result with 'title', 'channel' and 'duration' (seconds)
+        rank: Position in the search results, earlier results win ties
+    """
+    score = (0.5 * duration_score(track.get('duration_ms'), candidate.get('duration'))
+             + 0.5 * title_score(track, candidate))
+    score *= version_penalty(track, candidate)
+    return max(0.0, score - 0.01 * rank)
+
+
+def rank_candidates(track: dict, candidates: List[Dict]) -> Tuple[Optional[str], Optional[float]]:
+    """
+    Pick the best search result for a track
+
+    Returns:
+        (video_id, confidence), both None when there are no candidates
+    """
+    if not candidates:
+        return None, None
+    scored = [(score_candidate(track, candidate, rank), candidate)
+              for rank, candidate in enumerate(candidates)]
+    confidence, best = max(scored, key=lambda item: item[0])
+    return best['video_id'], round(confidence, 3)
@@ -2,15 +2,35 @@
 """
 Spotify to YouTube Converter - Web Application
 網頁版介面：Spotify 歌單轉換 YouTube 歌單並下載
-純記憶體模式 - 不儲存任何資料
+歌單資料保存在記憶體中，背景工作進度記錄在 SQLite 以便重啟後續傳
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 import os
 import subprocess
 import threading
-import asyncio
+import time
+import socket
+import uuid
+from datetime import datetime, timezone
 from pathlib import Path
+from urllib.parse import quote
+from rate_governor import governor, is_throttled_error
+from database import create_job, update_job, update_job_item, get_job_items, claim_unfinished_jobs
+from downloader import (
+    download_tracks,
+    BACKENDS,
+    AUDIO_FORMATS,
+    AUDIO_EXTENSIONS,
+    DEFAULT_BACKEND,
+    DEFAULT_WORKERS,
+    DEFAULT_AUDIO_FORMAT,
+    DEFAULT_TRANSCODE,
+    DownloadIndex,
+    TransferProgress,
+    clean_filename
+)
+from zip_stream import stream_zip
 
 app = Flask(__name__)
 
@@ -28,9 +48,22 @@ status = {
     'creating_playlist': False,
     'downloading': False,
     'message': '',
-    'progress': 0
+    'progress': 0,
+    'failed': [],
+    'scrape_backend': None,
+    'scrape_seconds': None
 }
 
+# 下載的位元組進度（速度、剩餘時間）
+download_progress = TransferProgress()
+
+# Set while run_download_job feeds download_progress; /api/download-youtube
+# shares the 'downloading' flag but not the byte counters
+transfer_active = threading.Event()
+
+# Upper bound for the 'workers' field of /api/download
+MAX_DOWNLOAD_WORKERS = int(os.environ.get('MAX_DOWNLOAD_WORKERS', '16'))
+
 
 @app.route('/')
 def index():
@@ -44,11 +77,29 @@ def get_tracks():
     return jsonify(current_playlist)
 
 
+def start_job(kind, params, items, runner, flag):
+    """
+    Create a job and run it in a background thread
+    
+    The busy flag is set before the job is created so a second request is
+    turned away, and cleared again if the job cannot be created.
+    
+    Returns:
+        ID of the new job
+    """
+    status[flag] = True
+    try:
+        job_id = create_job(kind, params, items, owner=JOB_OWNER)
+        threading.Thread(target=runner, args=(job_id, params), daemon=True).start()
+    except Exception:
+        status[flag] = False
+        raise
+    return job_id
+
+
 @app.route('/api/scrape', methods=['POST'])
 def scrape_playlist():
     """Start scraping a Spotify playlist"""
-    global current_playlist
-    
     data = request.get_json()
     url = data.get('url', '')
     
@@ -58,29 +109,97 @@ def scrape_playlist():
     if status['scraping']:
         return jsonify({'error': '正在抓取中，請稍候'}), 400
     
-    def run_scraper():
-        global current_playlist
-        status['scraping'] = True
-        status['message'] = '正在抓取歌單...'
+    job_id = start_job('scrape', {'url': url}, [{'url': url}], run_scrape_job, 'scraping')
+    return jsonify({'status': 'started', 'job_id': job_id})
+
+
+def spotify_credentials():
+    """Spotify API client credentials from the environment, or None"""
+    client_id = os.environ.get('SPOTIFY_CLIENT_ID')
+    client_secret = os.environ.get('SPOTIFY_CLIENT_SECRET')
+    if client_id and client_secret:
+        return client_id, client_secret
+    return None
+
+
+def scrape_with_api(url):
+    """
+    Fetch a playlist through the Spotify Web API
+    
+    Returns:
+        Playlist dictionary, or None when no credentials are set, spotipy
+        is missing or the request fails (the caller falls back to the browser)
+    """
+    credentials = spotify_credentials()
+    if not credentials:
+        return None
+    try:
+        from spotify_api import fetch_playlist_tracks
+    except ImportError:
+        print('未安裝 spotipy，改用瀏覽器抓取')
+        return None
+    
+    try:
+        return fetch_playlist_tracks(*credentials, url, output_file=None)
+    except Exception as e:
+        print(f'Spotify API 抓取失敗，改用瀏覽器: {e}')
+        return None
+
+
+def scrape_with_browser(url):
+    """Scrape a playlist page in a fresh context of the shared, already running Chromium"""
+    from browser_pool import browser_pool
+    from scraper_memory import scrape_playlist_to_memory
+    return browser_pool.run(scrape_playlist_to_memory, url)
+
+
+def run_scrape_job(job_id, params):
+    """
+    Scrape a playlist, checkpointing into the jobs table
+    
+    Uses the Spotify Web API when SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET
+    are set, and the Playwright scraper otherwise or when the API fails.
+    """
+    global current_playlist
+    url = params['url']
+    status['scraping'] = True
+    status['message'] = '正在抓取歌單...'
+    status['scrape_backend'] = None
+    status['scrape_seconds'] = None
+    
+    try:
+        update_job_item(job_id, 0, 'running')
+        started = time.monotonic()
         
-        try:
-            # 直接在這裡執行抓取，不透過子程序
-            from scraper_memory import scrape_playlist_to_memory
-            result = asyncio.run(scrape_playlist_to_memory(url))
+        # 直接在這裡執行抓取，不透過子程序
+        backend = 'api'
+        result = scrape_with_api(url)
+        if not result or not result.get('tracks'):
+            backend = 'browser'
+            status['message'] = '正在以瀏覽器抓取歌單...'
+            result = scrape_with_browser(url)
+        
+        elapsed = round(time.monotonic() - started, 2)
+        status['scrape_backend'] = backend
+        status['scrape_seconds'] = elapsed
+        print(f'抓取方式: {backend}，耗時 {elapsed} 秒')
+        
+        if result and result.get('tracks'):
+            result.update(backend=backend, elapsed=elapsed)
+            current_playlist = result
+            status['message'] = f"抓取完成！共 {result['total_tracks']} 首歌曲（{backend}，{elapsed} 秒）"
+            update_job_item(job_id, 0, 'done', result)
+            update_job(job_id, state='done', message=status['message'])
+        else:
+            status['message'] = '抓取失敗：找不到歌曲'
+            update_job_item(job_id, 0, 'failed')
+            update_job(job_id, state='failed', message=status['message'])
             
-            if result and result.get('tracks'):
-                current_playlist = result
-                status['message'] = f"抓取完成！共 {result['total_tracks']} 首歌曲"
-            else:
-                status['message'] = '抓取失敗：找不到歌曲'
-                
-        except Exception as e:
-            status['message'] = f'錯誤: {e}'
-        finally:
-            status['scraping'] = False
-    
-    threading.Thread(target=run_scraper, daemon=True).start()
-    return jsonify({'status': 'started'})
+    except Exception as e:
+        status['message'] = f'錯誤: {e}'
+        update_job(job_id, state='failed', message=status['message'])
+    finally:
+        status['scraping'] = False
 
 
 @app.route('/api/download-youtube', methods=['POST'])
@@ -126,11 +245,26 @@ def download_youtube():
                     url
                 ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+            if governor.requests.rate:
+                cmd[-1:-1] = ['--sleep-requests', f"{1 / governor.requests.rate:.2f}"]
+            
+            # Shares the governor with the playlist downloads: waits out any
+            # 429 backoff and counts as one download towards the bandwidth
+            governor.acquire_request()
+            governor.download_started()
+            try:
+                if governor.bytes.rate:
+                    cmd[-1:-1] = ['--limit-rate', str(max(1024, int(governor.rate_share())))]
+                result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+            finally:
+                governor.download_finished()
             
             if result.returncode == 0:
+                governor.report_success()
                 status['message'] = '下載完成！'
             else:
+                if is_throttled_error(result.stderr):
+                    governor.report_throttled()
                 status['message'] = f'下載失敗: {result.stderr[:200]}'
             
             status['progress'] = 100
@@ -146,6 +280,29 @@ def download_youtube():
     return jsonify({'status': 'started'})
 
 
+def parse_bool(value, default: bool = False) -> bool:
+    """
+    Read a boolean request field
+    
+    Accepts JSON booleans and the strings 'true'/'false', '1'/'0',
+    'yes'/'no' and 'on'/'off'.
+    
+    Raises:
+        ValueError: for anything else
+    """
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text in ('true', '1', 'yes', 'on'):
+            return True
+        if text in ('false', '0', 'no', 'off', ''):
+            return False
+    raise ValueError(f'不是布林值: {value!r}')
+
+
 @app.route('/api/download', methods=['POST'])
 def download_songs():
     """Start downloading all songs"""
@@ -155,58 +312,114 @@ def download_songs():
     if not current_playlist.get('tracks'):
         return jsonify({'error': '找不到歌曲資料，請先抓取歌單'}), 400
     
-    def run_download():
-        status['downloading'] = True
-        status['message'] = '正在下載歌曲...'
-        status['progress'] = 0
-        
-        try:
-            tracks = current_playlist['tracks']
-            download_dir = Path('downloads')
-            download_dir.mkdir(exist_ok=True)
-            
-            total = len(tracks)
-            success = 0
-            
-            for i, track in enumerate(tracks):
-                artists = ', '.join(track.get('artists', []))
-                search_query = track.get('search_query', f"{track['name']} {artists}")
-                filename = f"{track['name']} - {artists}"
-                filename = "".join(c for c in filename if c not in r'\/:*?"<>|')
-                
-                status['message'] = f"下載中 [{i+1}/{total}]: {track['name']}"
-                status['progress'] = int((i + 1) / total * 100)
-                
-                try:
-                    cmd = [
-                        'yt-dlp', '-x', '--audio-format', 'mp3',
-                        '--audio-quality', '0',
-                        '-o', str(download_dir / f'{filename}.%(ext)s'),
-                        '--no-playlist', '--quiet',
-                        '--default-search', 'ytsearch',
-                        f'ytsearch:{search_query}'
-                    ]
-                    subprocess.run(cmd, timeout=120)
-                    success += 1
-                except:
-                    pass
-            
-            status['message'] = f'下載完成！成功: {success}/{total}'
-            status['progress'] = 100
-            
-        except Exception as e:
-            status['message'] = f'錯誤: {e}'
-        finally:
-            status['downloading'] = False
+    data = request.get_json(silent=True) or {}
+    try:
+        workers = int(data.get('workers') or DEFAULT_WORKERS)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'workers 必須是整數'}), 400
+    workers = max(1, min(workers, MAX_DOWNLOAD_WORKERS))
+    backend_name = data.get('backend') or DEFAULT_BACKEND
+    if backend_name not in BACKENDS:
+        return jsonify({'error': f'未知的下載後端: {backend_name}'}), 400
+    audio_format = data.get('audio_format') or DEFAULT_AUDIO_FORMAT
+    if audio_format not in AUDIO_FORMATS:
+        return jsonify({'error': f'未知的音訊格式: {audio_format}'}), 400
+    try:
+        transcode = parse_bool(data.get('transcode'), DEFAULT_TRANSCODE)
+    except ValueError:
+        return jsonify({'error': 'transcode 必須是 true 或 false'}), 400
     
-    threading.Thread(target=run_download, daemon=True).start()
-    return jsonify({'status': 'started'})
+    params = {
+        'playlist_name': current_playlist.get('playlist_name', ''),
+        'playlist_url': current_playlist.get('playlist_url', ''),
+        'workers': workers,
+        'backend': backend_name,
+        'audio_format': audio_format,
+        'transcode': transcode
+    }
+    job_id = start_job('download', params, current_playlist['tracks'], run_download_job, 'downloading')
+    return jsonify({'status': 'started', 'job_id': job_id})
+
+
+def run_download_job(job_id, params):
+    """Download the pending items of a job, checkpointing each track"""
+    status['downloading'] = True
+    status['message'] = '正在下載歌曲...'
+    status['progress'] = 0
+    status['failed'] = []
+    
+    try:
+        items = get_job_items(job_id)
+        restore_playlist(params, items)
+        pending = [item for item in items if item['state'] == 'pending']
+        total = len(items)
+        finished = total - len(pending)
+        download_progress.reset(finished_tracks=finished)
+        transfer_active.set()
+        
+        def on_start(i, track):
+            update_job_item(job_id, pending[i]['index'], 'running')
+        
+        def on_result(result, done, _):
+            track = result['track']
+            update_job_item(job_id, pending[result['index']]['index'],
+                            'done' if result['success'] else 'failed', {
+                                'error': result['error'],
+                                'video_id': result['video_id'],
+                                'filepath': result['filepath']
+                            })
+            if not result['success']:
+                status['failed'].append(track['name'])
+            status['message'] = f"下載中 [{finished + done}/{total}]: {track['name']}"
+            status['progress'] = int((finished + done) / total * 100)
+        
+        summary = download_tracks(
+            [item['payload'] for item in pending], Path('downloads'),
+            workers=params.get('workers', DEFAULT_WORKERS),
+            backend=params.get('backend'),
+            audio_format=params.get('audio_format', DEFAULT_AUDIO_FORMAT),
+            transcode=params.get('transcode', DEFAULT_TRANSCODE),
+            progress=download_progress,
+            on_start=on_start, on_result=on_result
+        )
+        
+        success = len(get_job_items(job_id, ['done']))
+        status['message'] = f"下載完成！成功: {success}/{total}（略過已下載: {summary['skipped']}）"
+        status['progress'] = 100
+        update_job(job_id, state='done', message=status['message'])
+        
+    except Exception as e:
+        status['message'] = f'錯誤: {e}'
+        update_job(job_id, state='failed', message=status['message'])
+    finally:
+        transfer_active.clear()
+        status['downloading'] = False
 
 
 @app.route('/api/status')
 def get_status():
     """Get current operation status"""
-    return jsonify(status)
+    if not transfer_active.is_set():
+        return jsonify(status)
+    
+    # Byte-level progress of the running download
+    transfer = download_progress.snapshot()
+    return jsonify(dict(status, progress=transfer['percent'], transfer=transfer))
+
+
+@app.route('/api/limits', methods=['GET', 'POST'])
+def download_limits():
+    """Get or change the shared download bandwidth and request-rate limits"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            governor.set_limits(
+                bytes_per_sec=data.get('bytes_per_sec'),
+                requests_per_sec=data.get('requests_per_sec')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    return jsonify(governor.limits())
 
 
 @app.route('/api/youtube/create', methods=['POST'])
@@ -221,24 +434,85 @@ def create_youtube_playlist():
     if not current_playlist.get('tracks'):
         return jsonify({'error': '找不到歌曲資料，請先抓取歌單'}), 400
     
-    def run_create():
-        status['creating_playlist'] = True
-        status['message'] = '正在建立 YouTube 歌單...'
-        
-        try:
-            from youtube_playlist import create_youtube_playlist_from_tracks
-            tracks = current_playlist['tracks']
-            results = create_youtube_playlist_from_tracks(tracks, playlist_name)
-            
-            status['message'] = f"完成！成功: {len(results['added'])} 首\n歌單網址: {results['playlist_url']}"
-            
-        except Exception as e:
-            status['message'] = f'錯誤: {e}'
-        finally:
-            status['creating_playlist'] = False
+    from youtube_playlist import RESOLVERS, DEFAULT_RESOLVER
+    resolver = data.get('resolver') or DEFAULT_RESOLVER
+    if resolver not in RESOLVERS:
+        return jsonify({'error': f'未知的搜尋方式: {resolver}'}), 400
     
-    threading.Thread(target=run_create, daemon=True).start()
-    return jsonify({'status': 'started'})
+    params = {
+        'name': playlist_name,
+        'playlist_name': current_playlist.get('playlist_name', ''),
+        'playlist_url': current_playlist.get('playlist_url', ''),
+        'playlist_id': None,
+        'resolver': resolver
+    }
+    job_id = start_job('youtube_create', params, current_playlist['tracks'],
+                       run_youtube_create_job, 'creating_playlist')
+    return jsonify({'status': 'started', 'job_id': job_id})
+
+
+def run_youtube_create_job(job_id, params):
+    """Search and add the pending items of a job to the YouTube playlist"""
+    status['creating_playlist'] = True
+    status['message'] = '正在建立 YouTube 歌單...'
+    
+    try:
+        # Quota ran out earlier, wait for the daily reset
+        if params.get('resume_at') and schedule_job_resume(job_id, params):
+            return
+        
+        from youtube_playlist import create_youtube_playlist_from_tracks
+        items = get_job_items(job_id)
+        restore_playlist(params, items)
+        pending = [item for item in items if item['state'] == 'pending']
+        
+        def on_playlist(playlist_id):
+            # Remember the playlist so a resumed job does not create another one
+            if params.get('playlist_id') != playlist_id:
+                params['playlist_id'] = playlist_id
+                update_job(job_id, params=params)
+        
+        def on_track(i, track, outcome, video_id):
+            update_job_item(job_id, pending[i]['index'],
+                            'done' if outcome == 'added' else 'failed',
+                            {'outcome': outcome, 'video_id': video_id})
+        
+        results = create_youtube_playlist_from_tracks(
+            [item['payload'] for item in pending], params['name'],
+            playlist_id=params.get('playlist_id'),
+            on_playlist=on_playlist, on_track=on_track,
+            resolver=params.get('resolver')
+        )
+        
+        added = len(get_job_items(job_id, ['done']))
+        if results.get('resume_at'):
+            params['resume_at'] = results['resume_at']
+            update_job(job_id, state='pending', params=params)
+            schedule_job_resume(job_id, params)
+            return
+        
+        status['message'] = f"完成！成功: {added} 首\n歌單網址: {results['playlist_url']}"
+        update_job(job_id, state='done', message=status['message'])
+        
+    except Exception as e:
+        status['message'] = f'錯誤: {e}'
+        update_job(job_id, state='failed', message=status['message'])
+    finally:
+        status['creating_playlist'] = False
+
+
+@app.route('/api/youtube/quota')
+def youtube_quota():
+    """Get today's YouTube API quota usage and the cost estimate of the current playlist"""
+    from youtube_quota import DAILY_QUOTA, used_today, estimate_job_cost
+    from youtube_playlist import get_resolver
+    resolver = get_resolver(request.args.get('resolver'))
+    return jsonify({
+        'daily_quota': DAILY_QUOTA,
+        'used': used_today(),
+        'estimate': estimate_job_cost(current_playlist.get('tracks', []),
+                                      search_cost=resolver.search_cost)
+    })
 
 
 @app.route('/api/clear', methods=['POST'])
@@ -269,6 +543,44 @@ def open_download_folder():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/export')
+def export_playlist():
+    """Stream a ZIP of the playlist's downloaded files"""
+    playlist = current_playlist
+    if 'playlist_id' in request.args:
+        from database import get_playlist_by_id
+        try:
+            playlist_id = int(request.args['playlist_id'])
+        except ValueError:
+            return jsonify({'error': 'playlist_id 必須是整數'}), 400
+        playlist = get_playlist_by_id(playlist_id)
+        if not playlist:
+            return jsonify({'error': '找不到歌單'}), 404
+    
+    if not playlist.get('tracks'):
+        return jsonify({'error': '找不到歌曲資料，請先抓取歌單'}), 400
+    
+    index = DownloadIndex(Path('downloads'))
+    files = []
+    names = set()
+    for track in playlist['tracks']:
+        # Read-only: an export must not add or drop index entries
+        path = index.find(track)
+        if not path or path.name in names:
+            continue
+        names.add(path.name)
+        files.append((path.name, path))
+    
+    if not files:
+        return jsonify({'error': '此歌單還沒有已下載的檔案'}), 404
+    
+    zip_name = clean_filename(playlist.get('playlist_name') or 'playlist') + '.zip'
+    headers = {
+        'Content-Disposition': f"attachment; filename=\"playlist.zip\"; filename*=UTF-8''{quote(zip_name)}"
+    }
+    return Response(stream_with_context(stream_zip(files)), mimetype='application/zip', headers=headers)
+
+
 # ============ MP3 Editor APIs ============
 
 @app.route('/editor')
@@ -279,12 +591,14 @@ def editor():
 
 @app.route('/api/files')
 def list_files():
-    """List all MP3 files in downloads folder"""
+    """List all audio files in downloads folder"""
     download_dir = Path('downloads')
     download_dir.mkdir(exist_ok=True)
     
     files = []
-    for f in download_dir.glob('*.mp3'):
+    for f in download_dir.iterdir():
+        if f.suffix not in AUDIO_EXTENSIONS:
+            continue
         stat = f.stat()
         files.append({
             'name': f.name,
@@ -407,8 +721,114 @@ def delete_file():
         return jsonify({'error': str(e)}), 500
 
 
+# ============ Job Recovery ============
+
+# 此程序的識別碼，用來認領中斷的背景工作
+JOB_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+JOB_RUNNERS = {
+    'scrape': (run_scrape_job, 'scraping'),
+    'download': (run_download_job, 'downloading'),
+    'youtube_create': (run_youtube_create_job, 'creating_playlist'),
+}
+
+
+def is_owner_alive(owner):
+    """Check whether the process that owns a job is still running"""
+    try:
+        host, pid, token = owner.rsplit(':', 2)
+        pid = int(pid)
+    except ValueError:
+        return False
+    
+    # The database file is local, so jobs from other hosts are stale
+    if host != socket.gethostname():
+        return False
+    if pid == os.getpid():
+        return owner == JOB_OWNER
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def restore_playlist(params, items):
+    """Rebuild the in-memory playlist from a resumed job"""
+    global current_playlist
+    if current_playlist.get('tracks'):
+        return
+    tracks = [item['payload'] for item in items]
+    current_playlist = {
+        'playlist_name': params.get('playlist_name', ''),
+        'playlist_url': params.get('playlist_url', ''),
+        'total_tracks': len(tracks),
+        'tracks': tracks
+    }
+
+
+def schedule_job_resume(job_id, params):
+    """
+    Resume a quota-limited YouTube job after the quota reset
+    
+    Returns:
+        True if the job was scheduled, False if it can run now
+    """
+    resume_at = datetime.fromisoformat(params['resume_at'])
+    delay = (resume_at - datetime.now(timezone.utc)).total_seconds()
+    if delay <= 0:
+        return False
+    
+    status['message'] = f"今日 YouTube 配額已用完，將於 {resume_at.astimezone():%m/%d %H:%M} 自動繼續"
+    update_job(job_id, state='pending', message=status['message'])
+    
+    def resume():
+        if status['creating_playlist']:
+            # Another job is running, try again later
+            retry = threading.Timer(60, resume)
+            retry.daemon = True
+            retry.start()
+            return
+        status['creating_playlist'] = True
+        threading.Thread(target=run_youtube_create_job, args=(job_id, params), daemon=True).start()
+    
+    timer = threading.Timer(delay, resume)
+    timer.daemon = True
+    timer.start()
+    return True
+
+
+def resume_jobs():
+    """
+    Resume jobs interrupted by a crash or a recycled worker
+    
+    Only pending items are run again (items that were running are reset to
+    pending when the job is claimed). Failed items keep their result: they
+    failed on their own (no video found, download error) rather than
+    because the process stopped, and retrying them on every restart could
+    loop. Start a new job to retry them.
+    
+    Called from gunicorn's post_worker_init hook (gunicorn.conf.py), or
+    when the app is run directly, not on import.
+    """
+    for job in claim_unfinished_jobs(JOB_OWNER, is_owner_alive):
+        runner, flag = JOB_RUNNERS.get(job['kind'], (None, None))
+        if not runner or status[flag]:
+            update_job(job['id'], state='failed', message='無法繼續執行')
+            continue
+        
+        print(f"繼續執行中斷的工作 #{job['id']} ({job['kind']})")
+        status[flag] = True
+        threading.Thread(target=runner, args=(job['id'], job['params']), daemon=True).start()
+
+
 if __name__ == '__main__':
     os.makedirs('templates', exist_ok=True)
+    # With the debug reloader only the child process serves requests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        resume_jobs()
     app.run(debug=True, port=5000)
 
 
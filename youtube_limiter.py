@@ -0,0 +1,159 @@
+"""
+YouTube API Rate Limiter
+YouTube API 自適應限速：沒被限流時全速執行，遇到限流或伺服器錯誤時指數退避
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from googleapiclient.errors import HttpError
+
+from youtube_quota import QuotaExceeded, spend, mark_exhausted
+
+
+# Retries of a single request before giving up
+MAX_RETRIES = int(os.environ.get('YOUTUBE_MAX_RETRIES', '5'))
+
+# Exponential backoff after a rate limit or server error
+BACKOFF_BASE = 1  # seconds
+BACKOFF_MAX = 64  # seconds
+
+# Spacing between requests once the API has pushed back; it shrinks
+# again after every success until requests run back to back
+INTERVAL_STEP = 0.5  # seconds
+INTERVAL_MAX = 10  # seconds
+INTERVAL_DECAY = 0.8
+
+# Error reasons that mean "slow down and retry"
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded', 'backendError')
+
+# Error reasons that mean today's quota is gone
+QUOTA_REASONS = ('quotaExceeded', 'dailyLimitExceeded')
+
+
+def error_reason(error: HttpError) -> Optional[str]:
+    """Get the first 'reason' of a YouTube API error response"""
+    try:
+        body = json.loads(error.content.decode('utf-8'))
+        errors = body['error'].get('errors') or []
+        return errors[0].get('reason') if errors else None
+    except (ValueError, KeyError, AttributeError, TypeError):
+        return None
+
+
+def retry_after(error: HttpError) -> Optional[float]:
+    """Get the Retry-After header in seconds, if the response has one"""
+    value = getattr(error, 'resp', None) and error.resp.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: HttpError) -> bool:
+    """Check whether an API error is a rate limit or a transient server error"""
+    status = getattr(error.resp, 'status', 0)
+    reason = error_reason(error)
+    if reason in QUOTA_REASONS:
+        return False
+    return status == 429 or status >= 500 or reason in RATE_LIMIT_REASONS
+
+
+def is_quota_error(error: HttpError) -> bool:
+    """Check whether an API error means the daily quota is used up"""
+    return error_reason(error) in QUOTA_REASONS or 'quotaExceeded' in str(error)
+
+
+class AdaptiveLimiter:
+    """
+    Request pacing shared by every YouTube API call in the process
+
+    Requests are sent back to back until the API pushes back. A rate limit
+    or 5xx adds spacing between requests and pauses everyone for the
+    backoff (or the Retry-After the server asked for); each success
+    shrinks the spacing again.
+    """
+
+    def __init__(self):
+        self.interval = 0.0
+        self.next_request = 0.0
+        self.throttled_count = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next request may be sent"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self.next_request)
+            self.next_request = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def report_success(self):
+        with self._lock:
+            self.interval *= INTERVAL_DECAY
+            if self.interval < 0.05:
+                self.interval = 0.0
+
+    def report_throttled(self, delay: float):
+        """The API pushed back: widen the spacing and pause everyone"""
+        with self._lock:
+            self.interval = min(INTERVAL_MAX, self.interval * 2 or INTERVAL_STEP)
+            self.next_request = max(self.next_request, time.monotonic() + delay)
+            self.throttled_count += 1
+
+    def execute(self, request, method: Optional[str] = None, retries: int = MAX_RETRIES,
+                count: int = 1):
+        """
+        Execute a googleapiclient request through the limiter
+
+        Args:
+            request: Request object returned by the API client
+            method: Quota method (e.g. 'search.list') charged per attempt
+            retries: Retries on rate limits and server errors
+            count: Calls of `method` in the request (for batch requests)
+
+        Returns:
+            The response of request.execute()
+
+        Raises:
+            QuotaExceeded: If the daily quota is used up
+            HttpError: If the request fails for another reason or keeps
+                failing after all retries
+        """
+        for attempt in range(retries + 1):
+            self.wait()
+            if method:
+                spend(method, count)
+            try:
+                response = request.execute()
+            except HttpError as e:
+                if is_quota_error(e):
+                    mark_exhausted()
+                    raise QuotaExceeded("API 配額已用完")
+                if not is_retryable(e) or attempt == retries:
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    # Full jitter keeps concurrent callers from retrying in lockstep
+                    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+                self.report_throttled(delay)
+                print(f"YouTube API 限流 ({e.resp.status})，{delay:.1f} 秒後重試")
+                continue
+            self.report_success()
+            return response
+
+
+# 程序內所有 YouTube API 呼叫共用的限速器
+youtube_limiter = AdaptiveLimiter()
@@ -6,37 +6,106 @@ Creates a YouTube playlist and adds videos by searching for songs
 import os
 import json
 import pickle
-from googleapiclient.discovery import build
+import shutil
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional, Tuple
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.errors import HttpError
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
+from database import get_cached_search, cache_search, get_resolved_videos, save_resolved_video
+from downloader import DownloadError, get_backend, search_query
+from track_identity import track_key
+from video_ranking import CANDIDATE_COUNT, LOW_CONFIDENCE, parse_iso_duration, rank_candidates
+from youtube_quota import (
+    QUOTA_COSTS,
+    QuotaExceeded,
+    drop_hold,
+    hold,
+    mark_exhausted,
+    reserve,
+    release,
+    track_cost,
+    estimate_job_cost
+)
+from youtube_limiter import youtube_limiter, is_quota_error
 
 
 # YouTube API scopes
 SCOPES = ['https://www.googleapis.com/auth/youtube']
 
-# Rate limiting
-import time
-SEARCH_DELAY = 1  # seconds between searches to avoid rate limiting
+# Search result cache, a search costs 100 quota units
+SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL_DAYS', '30')) * 86400
+SEARCH_CACHE_NEGATIVE_TTL = int(os.environ.get('SEARCH_CACHE_NEGATIVE_TTL_HOURS', '24')) * 3600
 
+# Searches running at the same time while creating a playlist
+SEARCH_WORKERS = int(os.environ.get('YOUTUBE_SEARCH_WORKERS', '4'))
 
-def get_authenticated_service():
-    """Authenticate and return YouTube API service"""
-    credentials = None
-    
-    # Token file stores the user's access and refresh tokens
-    token_file = 'token.pickle'
+# How search queries are turned into video IDs: 'ytdlp' (no quota) or
+# 'api' (Data API search.list, 100 quota units per search)
+DEFAULT_RESOLVER = os.environ.get('YOUTUBE_RESOLVER', 'ytdlp')
+
+# Playlist inserts sent in one HTTP batch request
+INSERT_BATCH_SIZE = max(1, int(os.environ.get('YOUTUBE_INSERT_BATCH', '10')))
+
+# Token file stores the user's access and refresh tokens
+TOKEN_FILE = 'token.pickle'
+
+# Refresh the access token this long before it expires, so a request
+# in the middle of a long job never goes out with a stale token
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+# Credentials shared by the whole process
+_credentials = None
+_credentials_lock = threading.Lock()
+
+# Parsed discovery document, loaded once per process
+_discovery_document = None
+
+# Per-thread API clients (the httplib2 transport is not thread-safe)
+_thread_clients = threading.local()
+
+
+def needs_refresh(credentials) -> bool:
+    """Check whether credentials are invalid or about to expire"""
+    if not credentials.valid:
+        return True
+    if not credentials.expiry:
+        return False
+    # google-auth keeps expiry as a naive UTC datetime
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return credentials.expiry - now < TOKEN_REFRESH_MARGIN
+
+
+def get_credentials():
+    """
+    Get the process-wide OAuth credentials for the YouTube API
     
-    # Check if we have saved credentials
-    if os.path.exists(token_file):
-        with open(token_file, 'rb') as token:
-            credentials = pickle.load(token)
+    The token file is read once; afterwards the same credentials object
+    is handed out and refreshed shortly before it expires.
+    """
+    global _credentials
     
-    # If no valid credentials, let the user log in
-    if not credentials or not credentials.valid:
-        if credentials and credentials.expired and credentials.refresh_token:
+    with _credentials_lock:
+        credentials = _credentials
+        
+        # Check if we have saved credentials
+        if credentials is None and os.path.exists(TOKEN_FILE):
+            with open(TOKEN_FILE, 'rb') as token:
+                credentials = pickle.load(token)
+        
+        if credentials and not needs_refresh(credentials):
+            _credentials = credentials
+            return credentials
+        
+        if credentials and credentials.refresh_token:
             credentials.refresh(Request())
         else:
+            # No usable credentials, let the user log in
             if not os.path.exists('client_secret.json'):
                 raise FileNotFoundError(
                     "找不到 client_secret.json 檔案！\n"
@@ -49,40 +118,255 @@ def get_authenticated_service():
             credentials = flow.run_local_server(port=8080)
         
         # Save credentials for next run
-        with open(token_file, 'wb') as token:
+        with open(TOKEN_FILE, 'wb') as token:
             pickle.dump(credentials, token)
+        
+        _credentials = credentials
+        return credentials
+
+
+def get_discovery_document() -> Optional[dict]:
+    """Get the YouTube v3 discovery document bundled with google-api-python-client"""
+    global _discovery_document
+    if _discovery_document is None:
+        document = get_static_doc('youtube', 'v3')
+        if document:
+            _discovery_document = json.loads(document)
+    return _discovery_document
+
+
+def build_service(credentials):
+    """Build a YouTube API client from the bundled discovery document"""
+    document = get_discovery_document()
+    if document is None:
+        return build('youtube', 'v3', credentials=credentials)
+    return build_from_document(document, credentials=credentials)
+
+
+def get_authenticated_service():
+    """
+    Authenticate and return the calling thread's YouTube API service
     
-    return build('youtube', 'v3', credentials=credentials)
+    Clients are cached per thread and share the process-wide credentials,
+    so repeated calls are cheap and safe from worker threads.
+    """
+    credentials = get_credentials()
+    youtube = getattr(_thread_clients, 'youtube', None)
+    if youtube is None or _thread_clients.credentials is not credentials:
+        youtube = build_service(credentials)
+        _thread_clients.youtube = youtube
+        _thread_clients.credentials = credentials
+    return youtube
 
 
-def search_youtube_video(youtube, query: str) -> str:
+def get_playlist_size(youtube, playlist_id: str) -> int:
+    """Get the number of items already in a playlist"""
+    response = youtube_limiter.execute(youtube.playlistItems().list(
+        part='id',
+        playlistId=playlist_id,
+        maxResults=0
+    ), 'playlistItems.list')
+    return response['pageInfo']['totalResults']
+
+
+def list_playlist_items(youtube, playlist_id: str) -> List[dict]:
     """
-    Search for a video on YouTube and return its ID
+    Get the current items of a playlist, paging through all of them
+    
+    Returns:
+        List of {'id': playlist item ID, 'video_id': video ID} in playlist order
+    """
+    items = []
+    page_token = None
+    while True:
+        response = youtube_limiter.execute(youtube.playlistItems().list(
+            part='snippet',
+            playlistId=playlist_id,
+            maxResults=50,
+            pageToken=page_token,
+            fields='nextPageToken,items(id,snippet/resourceId/videoId)'
+        ), 'playlistItems.list')
+        for item in response.get('items', []):
+            items.append({
+                'id': item['id'],
+                'video_id': item['snippet']['resourceId']['videoId']
+            })
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return items
+
+
+def delete_playlist_item(youtube, item_id: str) -> bool:
+    """
+    Remove an item from a playlist
     
     Args:
         youtube: YouTube API service
-        query: Search query string
+        item_id: Playlist item ID (not the video ID)
         
     Returns:
-        Video ID or None if not found
+        True if successful, False otherwise
     """
     try:
-        search_response = youtube.search().list(
+        youtube_limiter.execute(youtube.playlistItems().delete(id=item_id), 'playlistItems.delete')
+        return True
+    except HttpError as e:
+        print(f"刪除影片錯誤: {e}")
+        return False
+
+
+class ApiResolver:
+    """
+    Find candidate videos with the Data API search.list
+    
+    The durations of all candidates are fetched with one videos.list call
+    (1 unit for up to 50 IDs).
+    """
+    
+    name = 'api'
+    uses_api = True
+    search_cost = QUOTA_COSTS['search.list'] + QUOTA_COSTS['videos.list']
+    
+    def candidates(self, youtube, query: str, count: int = CANDIDATE_COUNT) -> List[dict]:
+        search_response = youtube_limiter.execute(youtube.search().list(
             q=query,
             part='snippet',
-            maxResults=1,
+            maxResults=count,
             type='video',
-            videoCategoryId='10'  # Music category
-        ).execute()
+            videoCategoryId='10',  # Music category
+            fields='items(id/videoId,snippet(title,channelTitle))'
+        ), 'search.list')
         
-        if search_response['items']:
-            video = search_response['items'][0]
-            return video['id']['videoId']
+        candidates = [{
+            'video_id': item['id']['videoId'],
+            'title': item['snippet']['title'],
+            'channel': item['snippet'].get('channelTitle', ''),
+            'duration': None
+        } for item in search_response.get('items', [])]
+        if not candidates:
+            return []
         
-    except HttpError as e:
+        details = youtube_limiter.execute(youtube.videos().list(
+            part='contentDetails',
+            id=','.join(c['video_id'] for c in candidates),
+            fields='items(id,contentDetails/duration)'
+        ), 'videos.list')
+        durations = {
+            item['id']: parse_iso_duration(item['contentDetails']['duration'])
+            for item in details.get('items', [])
+        }
+        for candidate in candidates:
+            candidate['duration'] = durations.get(candidate['video_id'])
+        return candidates
+
+
+class YtDlpResolver:
+    """Resolve search queries with a yt-dlp flat search, costing no API quota"""
+    
+    name = 'ytdlp'
+    uses_api = False
+    search_cost = 0
+    
+    def __init__(self):
+        self.backend = get_backend()
+    
+    def candidates(self, youtube, query: str, count: int = CANDIDATE_COUNT) -> List[dict]:
+        # Flat search results already carry title, channel and duration
+        return search_query(self.backend, query, count)
+
+
+RESOLVERS = {
+    'api': ApiResolver,
+    'ytdlp': YtDlpResolver,
+}
+
+_resolvers = {}
+_resolvers_lock = threading.Lock()
+
+
+def get_resolver(name: Optional[str] = None):
+    """
+    Get the shared resolver instance
+    
+    Falls back to the API resolver when yt-dlp is not installed.
+    """
+    name = name or DEFAULT_RESOLVER
+    if name not in RESOLVERS:
+        raise ValueError(f"未知的搜尋方式: {name}")
+    
+    with _resolvers_lock:
+        if name not in _resolvers:
+            cls = RESOLVERS[name]
+            if cls is YtDlpResolver and not shutil.which('yt-dlp'):
+                try:
+                    import yt_dlp  # noqa: F401
+                except ImportError:
+                    print("找不到 yt-dlp，改用 YouTube API 搜尋")
+                    cls = ApiResolver
+            _resolvers[name] = cls()
+        return _resolvers[name]
+
+
+def match_track(youtube, track: dict, use_cache: bool = True,
+                resolver=None) -> Tuple[Optional[str], Optional[float]]:
+    """
+    Find the YouTube video of a track
+    
+    Several candidates are ranked by how close their length is to the
+    Spotify 'duration_ms' and how well their title matches, so live
+    versions and hour-long loops lose to the studio track. Results
+    (including "not found") are cached in SQLite with their confidence,
+    so repeated queries cost nothing until the entry expires.
+    
+    Args:
+        youtube: YouTube API service (only used by the API resolver)
+        track: Track dictionary with 'name', 'artists' and optionally
+            'search_query' and 'duration_ms'
+        use_cache: Consult and update the search cache
+        resolver: Resolver instance (defaults to get_resolver())
+        
+    Returns:
+        (video_id, confidence) - both None if not found
+    """
+    query = get_search_query(track)
+    if use_cache:
+        hit, video_id, confidence = get_cached_search(query)
+        if hit:
+            print(f"  (快取) {video_id or '找不到'}")
+            return video_id, confidence
+    
+    resolver = resolver or get_resolver()
+    try:
+        candidates = resolver.candidates(youtube, query)
+    except (HttpError, DownloadError) as e:
         print(f"搜尋錯誤: {e}")
+        return None, None
+    
+    video_id, confidence = rank_candidates(track, candidates)
+    if video_id and confidence < LOW_CONFIDENCE:
+        print(f"  ⚠️  低信心配對 ({confidence:.2f}): {query}")
     
-    return None
+    if use_cache:
+        ttl = SEARCH_CACHE_TTL if video_id else SEARCH_CACHE_NEGATIVE_TTL
+        cache_search(query, video_id, ttl, confidence)
+    return video_id, confidence
+
+
+def search_youtube_video(youtube, query: str, use_cache: bool = True,
+                         resolver=None) -> str:
+    """
+    Search for a video on YouTube and return its ID
+    
+    Args:
+        youtube: YouTube API service (only used by the API resolver)
+        query: Search query string
+        use_cache: Consult and update the search cache
+        resolver: Resolver instance (defaults to get_resolver())
+        
+    Returns:
+        Video ID or None if not found
+    """
+    return match_track(youtube, {'name': query, 'search_query': query}, use_cache, resolver)[0]
 
 
 def create_playlist(youtube, title: str, description: str = "") -> str:
@@ -98,7 +382,7 @@ def create_playlist(youtube, title: str, description: str = "") -> str:
         Playlist ID
     """
     try:
-        playlist = youtube.playlists().insert(
+        playlist = youtube_limiter.execute(youtube.playlists().insert(
             part='snippet,status',
             body={
                 'snippet': {
@@ -109,7 +393,7 @@ def create_playlist(youtube, title: str, description: str = "") -> str:
                     'privacyStatus': 'private'  # Start as private
                 }
             }
-        ).execute()
+        ), 'playlists.insert')
         
         return playlist['id']
         
@@ -118,7 +402,23 @@ def create_playlist(youtube, title: str, description: str = "") -> str:
         raise
 
 
-def add_video_to_playlist(youtube, playlist_id: str, video_id: str) -> bool:
+def playlist_insert_request(youtube, playlist_id: str, video_id: str,
+                            position: Optional[int] = None):
+    """Build (without executing) a playlistItems.insert request"""
+    snippet = {
+        'playlistId': playlist_id,
+        'resourceId': {
+            'kind': 'youtube#video',
+            'videoId': video_id
+        }
+    }
+    if position is not None:
+        snippet['position'] = position
+    return youtube.playlistItems().insert(part='snippet', body={'snippet': snippet})
+
+
+def add_video_to_playlist(youtube, playlist_id: str, video_id: str,
+                          position: Optional[int] = None) -> bool:
     """
     Add a video to a playlist
     
@@ -126,53 +426,172 @@ def add_video_to_playlist(youtube, playlist_id: str, video_id: str) -> bool:
         youtube: YouTube API service
         playlist_id: Target playlist ID
         video_id: Video ID to add
+        position: Zero-based position in the playlist (default: append)
         
     Returns:
         True if successful, False otherwise
     """
     try:
-        youtube.playlistItems().insert(
-            part='snippet',
-            body={
-                'snippet': {
-                    'playlistId': playlist_id,
-                    'resourceId': {
-                        'kind': 'youtube#video',
-                        'videoId': video_id
-                    }
-                }
-            }
-        ).execute()
+        youtube_limiter.execute(
+            playlist_insert_request(youtube, playlist_id, video_id, position),
+            'playlistItems.insert'
+        )
         return True
         
     except HttpError as e:
-        if 'quotaExceeded' in str(e):
-            print("API 配額已用完，請明天再試")
-            raise
         print(f"新增影片錯誤: {e}")
         return False
 
 
-def create_youtube_playlist_from_tracks(tracks: list, playlist_name: str) -> dict:
+def add_videos_to_playlist(youtube, playlist_id: str, video_ids: List[str],
+                           position: int,
+                           on_result: Optional[Callable[[int, bool], None]] = None) -> List[Optional[bool]]:
+    """
+    Add videos to a playlist in order using HTTP batch requests
+    
+    Up to INSERT_BATCH_SIZE inserts share one round trip. The server may
+    apply the parts of a batch in any order, so an insert whose position
+    does not exist yet can fail; failed inserts are retried one by one at
+    the position they should end up at.
+    
+    Args:
+        youtube: YouTube API service
+        playlist_id: Target playlist ID
+        video_ids: Video IDs in playlist order
+        position: Playlist position of the first video
+        on_result: Called as on_result(k, success) for each video
+        
+    Returns:
+        Success of each video, None for videos not attempted because the
+        quota ran out
+        
+    Raises:
+        QuotaExceeded: If the daily quota runs out; videos reported through
+            on_result before that were processed
+    """
+    outcomes = [None] * len(video_ids)
+    
+    def report(k: int, success: bool):
+        outcomes[k] = success
+        if on_result:
+            on_result(k, success)
+    
+    def position_of(k: int) -> int:
+        # Where video k belongs given which earlier videos made it in
+        return position + sum(1 for ok in outcomes[:k] if ok)
+    
+    for start in range(0, len(video_ids), INSERT_BATCH_SIZE):
+        chunk = range(start, min(start + INSERT_BATCH_SIZE, len(video_ids)))
+        failed = []
+        quota_hit = []
+        
+        def callback(request_id, response, exception):
+            k = int(request_id)
+            if exception is None:
+                report(k, True)
+            elif is_quota_error(exception):
+                quota_hit.append(k)
+            else:
+                failed.append(k)
+        
+        base = position_of(start)
+        batch = youtube.new_batch_http_request(callback=callback)
+        for k in chunk:
+            batch.add(playlist_insert_request(youtube, playlist_id, video_ids[k], base + k - start),
+                      request_id=str(k))
+        youtube_limiter.execute(batch, 'playlistItems.insert', count=len(chunk))
+        
+        if quota_hit:
+            mark_exhausted()
+            raise QuotaExceeded("API 配額已用完")
+        
+        if failed:
+            print(f"  批次新增有 {len(failed)} 首失敗，改為逐一新增")
+        for k in sorted(failed):
+            report(k, add_video_to_playlist(youtube, playlist_id, video_ids[k], position_of(k)))
+    
+    return outcomes
+
+
+def get_search_query(track: dict) -> str:
+    """Get the YouTube search query of a track"""
+    return track.get('search_query', f"{track.get('name', '')} {' '.join(track.get('artists', []))}")
+
+
+def create_youtube_playlist_from_tracks(tracks: list, playlist_name: str,
+                                        playlist_id: Optional[str] = None,
+                                        on_playlist: Optional[Callable[[str], None]] = None,
+                                        on_track: Optional[Callable[[int, dict, str, Optional[str]], None]] = None,
+                                        resolver: Optional[str] = None) -> dict:
     """
     Create a YouTube playlist from a list of tracks
     
+    Searches run ahead in a thread pool, each thread with its own API
+    client, while inserts are applied one by one in track order with an
+    explicit playlist position.
+    
     Args:
         tracks: List of track dictionaries with 'search_query' key
         playlist_name: Name for the new playlist
+        playlist_id: Existing playlist to add the tracks to (used to resume)
+        on_playlist: Called with the playlist ID once it exists
+        on_track: Called as on_track(i, track, outcome, video_id) after each
+            track, outcome is 'added', 'not_found' or 'error'
+        resolver: Search backend name, 'ytdlp' or 'api' (default: YOUTUBE_RESOLVER)
         
     Returns:
-        Dictionary with results
+        Dictionary with results. When today's quota runs out the run stops
+        before the next track and the result has 'remaining' (tracks not yet
+        processed) and 'resume_at' (next quota reset, ISO format)
     """
+    resolver = get_resolver(resolver)
+    estimate = estimate_job_cost(tracks, new_playlist=not playlist_id,
+                                 search_cost=resolver.search_cost)
+    print(f"\n預估配額: {estimate['units']} 單位（今日剩餘 {estimate['remaining']}）")
+    if estimate['affordable_tracks'] < len(tracks):
+        print(f"今日配額只夠處理 {estimate['affordable_tracks']}/{len(tracks)} 首，"
+              f"其餘將於 {estimate['resume_at']} 之後繼續")
+    
     print("\n正在連接 YouTube API...")
     youtube = get_authenticated_service()
     print("YouTube 連接成功！")
     
     # Create the playlist
-    print(f"\n正在建立歌單: {playlist_name}")
-    description = f"從 Spotify 轉換的歌單，共 {len(tracks)} 首歌曲"
-    playlist_id = create_playlist(youtube, playlist_name, description)
-    print(f"歌單已建立！ID: {playlist_id}")
+    position = 0
+    if playlist_id:
+        print(f"\n繼續使用歌單 ID: {playlist_id}")
+        try:
+            position = get_playlist_size(youtube, playlist_id)
+        except QuotaExceeded as e:
+            print(f"\n⚠️  {e}，將於 {e.resume_at.isoformat()} 之後繼續")
+            return {
+                'playlist_id': playlist_id,
+                'playlist_url': f'https://www.youtube.com/playlist?list={playlist_id}',
+                'added': [],
+                'not_found': [],
+                'errors': [],
+                'remaining': tracks,
+                'resume_at': e.resume_at.isoformat()
+            }
+    else:
+        print(f"\n正在建立歌單: {playlist_name}")
+        description = f"從 Spotify 轉換的歌單，共 {len(tracks)} 首歌曲"
+        try:
+            playlist_id = create_playlist(youtube, playlist_name, description)
+        except QuotaExceeded as e:
+            print(f"\n⚠️  {e}，將於 {e.resume_at.isoformat()} 之後再建立歌單")
+            return {
+                'playlist_id': None,
+                'playlist_url': None,
+                'added': [],
+                'not_found': [],
+                'errors': [],
+                'remaining': tracks,
+                'resume_at': e.resume_at.isoformat()
+            }
+        print(f"歌單已建立！ID: {playlist_id}")
+    if on_playlist:
+        on_playlist(playlist_id)
     
     # Search and add each track
     results = {
@@ -183,29 +602,128 @@ def create_youtube_playlist_from_tracks(tracks: list, playlist_name: str) -> dic
         'errors': []
     }
     
-    total = len(tracks)
-    for i, track in enumerate(tracks):
-        query = track.get('search_query', f"{track.get('name', '')} {' '.join(track.get('artists', []))}")
-        print(f"\n[{i+1}/{total}] 搜尋: {query}")
-        
-        video_id = search_youtube_video(youtube, query)
-        
+    reserved = {}  # track index -> units reserved for its search and insert, not spent yet
+    
+    def search(i: int) -> Tuple[Optional[str], Optional[float]]:
+        youtube = get_authenticated_service() if resolver.uses_api else None
+        # The search is paid out of the track's reservation
+        hold(reserved[i])
+        try:
+            return match_track(youtube, tracks[i], resolver=resolver)
+        finally:
+            reserved[i] = drop_hold()
+    
+    def submit(pool: ThreadPoolExecutor, i: int) -> Future:
+        # Reserve the track's units in playlist order before its search
+        # starts, so concurrent searches cannot all pass the same check
+        units = track_cost(tracks[i], resolver.search_cost)
+        if not reserve(units):
+            future = Future()
+            future.set_exception(QuotaExceeded("今日配額不足以處理下一首歌曲"))
+            return future
+        reserved[i] = units
+        return pool.submit(search, i)
+    
+    confidences = {}  # track index -> match confidence
+    
+    def record(i: int, track: dict, video_id: Optional[str], added: bool):
+        release(reserved.pop(i, 0))
         if video_id:
-            if add_video_to_playlist(youtube, playlist_id, video_id):
-                print(f"  ✓ 已新增: https://www.youtube.com/watch?v={video_id}")
+            if added:
+                print(f"  ✓ 已新增 [{i+1}]: https://www.youtube.com/watch?v={video_id}")
                 results['added'].append({
                     'track': track,
-                    'video_id': video_id
+                    'video_id': video_id,
+                    'confidence': confidences.get(i)
                 })
+                outcome = 'added'
             else:
-                print(f"  ✗ 新增失敗")
+                print(f"  ✗ 新增失敗 [{i+1}]: {get_search_query(track)}")
                 results['errors'].append(track)
+                outcome = 'error'
         else:
-            print(f"  ✗ 找不到影片")
             results['not_found'].append(track)
+            outcome = 'not_found'
         
-        # Rate limiting
-        time.sleep(SEARCH_DELAY)
+        if on_track:
+            on_track(i, track, outcome, video_id)
+    
+    waiting = []  # (i, track, video_id) searched but not inserted yet
+    unfinished = []  # tracks whose insert was cut off by the quota
+    
+    def flush():
+        """Insert the waiting videos in one batch and record their tracks in order"""
+        nonlocal position
+        found = [entry for entry in waiting if entry[2]]
+        inserted = [None] * len(found)
+        
+        def on_result(k, success):
+            inserted[k] = success
+        
+        # The inserts are paid out of what their tracks still have reserved
+        hold(sum(reserved.pop(entry[0], 0) for entry in waiting))
+        try:
+            add_videos_to_playlist(get_authenticated_service(), playlist_id,
+                                   [entry[2] for entry in found], position, on_result)
+        finally:
+            release(drop_hold())
+            position += sum(1 for ok in inserted if ok)
+            k = 0
+            for i, track, video_id in waiting:
+                if video_id:
+                    success, k = inserted[k], k + 1
+                    if success is None:
+                        unfinished.append(track)
+                        continue
+                    record(i, track, video_id, success)
+                else:
+                    record(i, track, None, False)
+            waiting.clear()
+    
+    total = len(tracks)
+    workers = max(1, SEARCH_WORKERS)
+    window = max(workers, INSERT_BATCH_SIZE) * 2  # searches allowed to run ahead of the inserts
+    pending = deque()
+    submitted = 0
+    stopped_at = None
+    
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            try:
+                for i, track in enumerate(tracks):
+                    while submitted < total and submitted < i + window:
+                        pending.append(submit(pool, submitted))
+                        submitted += 1
+                    
+                    try:
+                        video_id, confidences[i] = pending.popleft().result()
+                    except QuotaExceeded:
+                        stopped_at = i
+                        flush()  # inserts of searched tracks were already budgeted
+                        raise
+                    
+                    print(f"\n[{i+1}/{total}] 搜尋: {get_search_query(track)}")
+                    if not video_id:
+                        print(f"  ✗ 找不到影片")
+                    waiting.append((i, track, video_id))
+                    
+                    if sum(1 for entry in waiting if entry[2]) >= INSERT_BATCH_SIZE:
+                        stopped_at = i + 1
+                        flush()
+                stopped_at = total
+                flush()
+                
+            except QuotaExceeded as e:
+                remaining = unfinished + list(tracks[stopped_at:])
+                print(f"\n⚠️  {e}，已停止。剩餘 {len(remaining)} 首將於 {e.resume_at.isoformat()} 之後繼續")
+                results['remaining'] = remaining
+                results['resume_at'] = e.resume_at.isoformat()
+                for future in pending:
+                    future.cancel()
+    finally:
+        # Searches cut off by the quota stop (or an error) never reached an insert
+        for units in reserved.values():
+            release(units)
     
     # Summary
     print(f"\n{'='*50}")
@@ -213,6 +731,8 @@ def create_youtube_playlist_from_tracks(tracks: list, playlist_name: str) -> dic
     print(f"成功新增: {len(results['added'])} 首")
     print(f"找不到: {len(results['not_found'])} 首")
     print(f"錯誤: {len(results['errors'])} 首")
+    if results.get('remaining'):
+        print(f"配額不足未處理: {len(results['remaining'])} 首（{results['resume_at']} 之後可繼續）")
     print(f"\n歌單網址: {results['playlist_url']}")
     
     # Save results
@@ -223,6 +743,177 @@ def create_youtube_playlist_from_tracks(tracks: list, playlist_name: str) -> dic
     return results
 
 
+def sync_playlist(tracks: list, playlist_id: str, delete_extra: bool = False,
+                  resolver: Optional[str] = None) -> dict:
+    """
+    Bring an existing YouTube playlist in line with a Spotify track list
+    
+    The playlist's current items are diffed against the tracks by track
+    key: a track counts as present when the video it resolved to before
+    (or resolves to now, through the search cache) is in the playlist.
+    Only tracks without a known video are searched and only missing
+    tracks are inserted, so a re-sync costs quota in proportion to what
+    changed rather than to the playlist size.
+    
+    Each missing track is inserted right after the previous Spotify track
+    that is in the playlist, so a playlist that was in Spotify order stays
+    in Spotify order. Items already in the playlist are not moved.
+    
+    Args:
+        tracks: Spotify tracks in playlist order
+        playlist_id: Target YouTube playlist ID
+        delete_extra: Remove playlist items that match no track
+        resolver: Search backend name, 'ytdlp' or 'api'
+        
+    Returns:
+        Result dictionary like create_youtube_playlist_from_tracks covering
+        all tracks, plus 'present' (count already in the playlist) and
+        'deleted' (removed item count). When today's quota runs out the
+        sync stops before the next search or insert and the result has
+        'remaining' and 'resume_at'
+    """
+    print("\n正在連接 YouTube API...")
+    youtube = get_authenticated_service()
+    resolver = get_resolver(resolver)
+    
+    results = {
+        'playlist_id': playlist_id,
+        'playlist_url': f'https://www.youtube.com/playlist?list={playlist_id}',
+        'added': [],
+        'not_found': [],
+        'errors': [],
+        'present': 0,
+        'deleted': 0
+    }
+    
+    def save() -> dict:
+        # Save the full picture so continue_adding.py still works afterwards
+        with open('youtube_results.json', 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        return results
+    
+    def stop(e: QuotaExceeded, remaining: list):
+        print(f"\n⚠️  {e}，已停止。剩餘 {len(remaining)} 首將於 {e.resume_at.isoformat()} 之後繼續")
+        results['remaining'] = remaining
+        results['resume_at'] = e.resume_at.isoformat()
+    
+    try:
+        items = list_playlist_items(youtube, playlist_id)
+    except QuotaExceeded as e:
+        stop(e, list(tracks))
+        return save()
+    claimed = [False] * len(items)
+    print(f"YouTube 歌單目前有 {len(items)} 部影片")
+    
+    def claim(video_id: Optional[str]) -> Optional[dict]:
+        # Each playlist item can only stand for one track (duplicates)
+        for k, item in enumerate(items):
+            if not claimed[k] and item['video_id'] == video_id:
+                claimed[k] = True
+                return item
+        return None
+    
+    # Tracks whose video is known from earlier runs
+    known = get_resolved_videos()
+    slots = [None] * len(tracks)  # playlist item standing for each track
+    found = [None] * len(tracks)  # video ID of each track
+    for i, track in enumerate(tracks):
+        video_id = known.get(track_key(track))
+        if video_id is None:
+            _, video_id, _ = get_cached_search(get_search_query(track))
+        slots[i] = claim(video_id) if video_id else None
+        found[i] = video_id
+    
+    todo = [track for i, track in enumerate(tracks) if not slots[i]]
+    estimate = estimate_job_cost(todo, new_playlist=False, search_cost=resolver.search_cost)
+    print(f"預估配額: {estimate['units']} 單位（今日剩餘 {estimate['remaining']}）")
+    
+    # Search only the tracks with no known video; a match already in the
+    # playlist needs no insert
+    insert_cost = QUOTA_COSTS['playlistItems.insert']
+    for i, track in enumerate(tracks):
+        if found[i]:
+            continue
+        units = max(0, track_cost(track, resolver.search_cost) - insert_cost)
+        try:
+            if not reserve(units):
+                raise QuotaExceeded("今日配額不足以搜尋下一首歌曲")
+            hold(units)
+            try:
+                video_id, _ = match_track(youtube if resolver.uses_api else None, track,
+                                          resolver=resolver)
+            finally:
+                release(drop_hold())
+        except QuotaExceeded as e:
+            stop(e, [t for k, t in enumerate(tracks) if not slots[k]])
+            results['added'] = [{'track': t, 'video_id': found[k]}
+                                for k, t in enumerate(tracks) if slots[k]]
+            results['present'] = len(results['added'])
+            return save()
+        found[i] = video_id
+        if video_id:
+            save_resolved_video(track_key(track), video_id, get_search_query(track))
+            slots[i] = claim(video_id)
+    
+    present = sum(1 for slot in slots if slot)
+    missing = sum(1 for i in range(len(tracks)) if not slots[i] and found[i])
+    print(f"已在歌單中: {present} 首，需要新增: {missing} 首")
+    
+    deleted = 0
+    if delete_extra:
+        for k, item in enumerate(items):
+            if claimed[k]:
+                continue
+            print(f"  刪除多餘影片: https://www.youtube.com/watch?v={item['video_id']}")
+            try:
+                if delete_playlist_item(youtube, item['id']):
+                    item['deleted'] = True
+                    deleted += 1
+            except QuotaExceeded as e:
+                print(f"\n⚠️  {e}，停止刪除")
+                break
+    
+    # Current playlist order; inserted tracks are added as they succeed
+    order = [item for item in items if not item.get('deleted')]
+    position = 0  # where the next missing track goes
+    for i, track in enumerate(tracks):
+        if slots[i]:
+            results['added'].append({'track': track, 'video_id': found[i]})
+            position = next(k for k, item in enumerate(order) if item is slots[i]) + 1
+            continue
+        if not found[i]:
+            results['not_found'].append(track)
+            continue
+        
+        try:
+            if not reserve(insert_cost):
+                raise QuotaExceeded("今日配額不足以新增下一首歌曲")
+            hold(insert_cost)
+            try:
+                added = add_video_to_playlist(youtube, playlist_id, found[i], position)
+            finally:
+                release(drop_hold())
+        except QuotaExceeded as e:
+            stop(e, [t for k, t in enumerate(tracks[i:], i) if not slots[k] and found[k]])
+            results['added'] += [{'track': t, 'video_id': found[k]}
+                                 for k, t in enumerate(tracks[i:], i) if slots[k]]
+            break
+        
+        if added:
+            print(f"  ✓ 已新增 [{position + 1}]: https://www.youtube.com/watch?v={found[i]}")
+            slots[i] = {'id': None, 'video_id': found[i]}
+            order.insert(position, slots[i])
+            position += 1
+            results['added'].append({'track': track, 'video_id': found[i]})
+        else:
+            print(f"  ✗ 新增失敗: {get_search_query(track)}")
+            results['errors'].append(track)
+    
+    results['present'] = present
+    results['deleted'] = deleted
+    print(f"同步完成！歌單共 {len(results['added'])} 首，刪除 {deleted} 部多餘影片")
+    return save()
+
 if __name__ == '__main__':
     # Test with sample data
     sample_tracks = [
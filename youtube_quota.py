@@ -0,0 +1,211 @@
+"""
+YouTube API Quota Ledger
+YouTube API 配額記帳：記錄每日用量、事先估算工作成本
+"""
+
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+from database import add_quota_usage, get_quota_usage, get_cached_search
+
+
+# Cost in quota units of each API method
+# https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {
+    'search.list': 100,
+    'videos.list': 1,
+    'playlists.insert': 50,
+    'playlistItems.insert': 50,
+    'playlistItems.list': 1,
+    'playlistItems.delete': 50,
+}
+
+# Daily quota of the Google Cloud project
+DAILY_QUOTA = int(os.environ.get('YOUTUBE_DAILY_QUOTA', '10000'))
+
+# The quota resets at midnight Pacific Time
+QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+
+# Pseudo method used to record that the API reported quotaExceeded
+EXHAUSTED = 'exhausted'
+
+_lock = threading.Lock()
+
+# Units set aside by reserve() for work that has not finished yet
+_reserved = 0
+
+# Part of a reservation spend() may draw on, per thread (see hold())
+_held = threading.local()
+
+
+class QuotaExceeded(Exception):
+    """Raised before a call that would go over the daily quota"""
+
+    def __init__(self, message: str, resume_at: Optional[datetime] = None):
+        super().__init__(message)
+        self.resume_at = resume_at or next_reset()
+
+
+def quota_day(now: Optional[datetime] = None) -> str:
+    """Get the quota day (Pacific date) as YYYY-MM-DD"""
+    now = now or datetime.now(timezone.utc)
+    return now.astimezone(QUOTA_TIMEZONE).strftime('%Y-%m-%d')
+
+
+def next_reset(now: Optional[datetime] = None) -> datetime:
+    """Get the next Pacific midnight as an aware UTC datetime"""
+    now = (now or datetime.now(timezone.utc)).astimezone(QUOTA_TIMEZONE)
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), QUOTA_TIMEZONE)
+    return midnight.astimezone(timezone.utc)
+
+
+def used_today() -> int:
+    """Quota units spent so far today"""
+    usage = get_quota_usage(quota_day())
+    if EXHAUSTED in usage:
+        return DAILY_QUOTA
+    return sum(usage.values())
+
+
+def remaining_quota() -> int:
+    """Quota units left today"""
+    return max(0, DAILY_QUOTA - used_today())
+
+
+def can_afford(units: int) -> bool:
+    """Check whether the given units still fit in today's quota"""
+    return units <= remaining_quota()
+
+
+def reserve(units: int) -> bool:
+    """
+    Set units aside for work about to start, if they fit in today's quota
+
+    Checking can_afford() and spending later is not atomic, so concurrent
+    workers could all pass the check and then run over the budget.
+    Reserved units count against the quota for other reserve() calls until
+    they are spent through hold() or given back with release().
+    Reservations are per process.
+
+    Returns:
+        True if the units were reserved
+    """
+    global _reserved
+    with _lock:
+        if units > remaining_quota() - _reserved:
+            return False
+        _reserved += units
+        return True
+
+
+def release(units: int):
+    """Give back units set aside by reserve()"""
+    global _reserved
+    with _lock:
+        _reserved = max(0, _reserved - units)
+
+
+def hold(units: int):
+    """
+    Let spend() calls on this thread draw on units the caller reserved
+
+    Units a call draws move from the reservation to the ledger, so a call
+    is never counted both as reserved and as used. End with drop_hold().
+    """
+    _held.units = units
+
+
+def drop_hold() -> int:
+    """Stop drawing on the reservation and get the units left undrawn"""
+    units = getattr(_held, 'units', 0)
+    _held.units = 0
+    return units
+
+
+def spend(method: str, count: int = 1):
+    """
+    Charge an API call to today's ledger
+
+    Call this right before executing the request; YouTube charges failed
+    requests too. Units held by this thread (see hold()) are used first.
+
+    Raises:
+        QuotaExceeded: If the call would go over the daily quota
+    """
+    global _reserved
+    units = QUOTA_COSTS[method] * count
+    with _lock:
+        if units > remaining_quota():
+            raise QuotaExceeded(f"今日 YouTube API 配額不足（{method} 需要 {units} 單位）")
+        add_quota_usage(quota_day(), method, units, count)
+        drawn = min(units, getattr(_held, 'units', 0))
+        if drawn:
+            _held.units -= drawn
+            _reserved = max(0, _reserved - drawn)
+
+
+def mark_exhausted():
+    """Record that the API itself answered quotaExceeded"""
+    add_quota_usage(quota_day(), EXHAUSTED, 0, 1)
+
+
+def track_cost(track: dict, search_cost: int = QUOTA_COSTS['search.list']) -> int:
+    """
+    Quota units needed to search (unless cached) and insert one track
+
+    Args:
+        track: Track dictionary
+        search_cost: Units of one uncached search (0 for resolvers that
+            do not use the Data API)
+    """
+    query = track.get('search_query', f"{track.get('name', '')} {' '.join(track.get('artists', []))}")
+    hit, video_id, _ = get_cached_search(query)
+    if hit and not video_id:
+        return 0
+    cost = QUOTA_COSTS['playlistItems.insert']
+    if not hit:
+        cost += search_cost
+    return cost
+
+
+def estimate_job_cost(tracks: List[dict], new_playlist: bool = True,
+                      search_cost: int = QUOTA_COSTS['search.list']) -> Dict:
+    """
+    Estimate the quota cost of adding tracks to a playlist
+
+    Searches answered by the search cache are free.
+
+    Args:
+        tracks: Track dictionaries with 'search_query'
+        new_playlist: Whether a playlist has to be created first
+        search_cost: Units of one uncached search
+
+    Returns:
+        Dictionary with 'units', 'searches' (paid searches), 'inserts', 'remaining' and
+        'affordable_tracks' (how many tracks fit in today's quota)
+    """
+    per_track = [track_cost(track, search_cost) for track in tracks]
+    searches = sum(1 for cost in per_track if cost > QUOTA_COSTS['playlistItems.insert'])
+
+    units = sum(per_track) + (QUOTA_COSTS['playlists.insert'] if new_playlist else 0)
+    remaining = remaining_quota()
+
+    affordable = 0
+    budget = remaining - (QUOTA_COSTS['playlists.insert'] if new_playlist else 0)
+    for cost in per_track:
+        if cost > budget:
+            break
+        budget -= cost
+        affordable += 1
+
+    return {
+        'units': units,
+        'searches': searches,
+        'inserts': sum(1 for cost in per_track if cost),
+        'remaining': remaining,
+        'affordable_tracks': affordable,
+        'resume_at': next_reset().isoformat() if affordable < len(tracks) else None
+    }
@@ -0,0 +1,72 @@
+"""
+Streaming ZIP Writer
+邊讀邊產生 ZIP（不壓縮），不需把整個壓縮檔放在記憶體或磁碟
+"""
+
+import io
+import time
+import zipfile
+from pathlib import Path
+from typing import Iterable, Iterator, Tuple
+
+
+# Bytes read from each file per chunk
+CHUNK_SIZE = 1024 * 1024
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """Write-only, non-seekable sink that collects bytes until drained"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(files: Iterable[Tuple[str, Path]], chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Generate a stored (uncompressed) ZIP archive chunk by chunk
+
+    Because the sink is not seekable, zipfile writes each entry's sizes and
+    CRC in a data descriptor after the data, so only one chunk is held in
+    memory at a time. ZIP64 is used for large files.
+
+    Args:
+        files: (name inside the archive, path on disk) pairs
+        chunk_size: Bytes read from each file per chunk
+
+    Yields:
+        Consecutive pieces of the ZIP file
+    """
+    sink = _ChunkBuffer()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for arcname, path in files:
+            stat = Path(path).stat()
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime(stat.st_mtime)[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            info.file_size = stat.st_size  # lets zipfile decide on ZIP64 up front
+
+            with open(path, 'rb') as src, zf.open(info, 'w') as dest:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()